@@ -1,7 +1,36 @@
-from openai import OpenAI  # New import
 import asyncio
-from llama_cpp import Llama
-from settings import MODEL_PATH, CONTEXT_LENGTH
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional
+from settings import (
+    MODEL_PATH,
+    CONTEXT_LENGTH,
+    PROMPT_CACHE_BYTES,
+    RESPONSE_CACHE_SIZE,
+    RESPONSE_CACHE_PATH,
+    LLM_MAX_IN_FLIGHT,
+    LLM_REQUEST_TIMEOUT,
+    LLM_MAX_RETRIES,
+    LLM_MAX_PENDING,
+    OPENAI_BASE_URL,
+    LLM_METRICS_PATH,
+    LLM_METRICS_INTERVAL,
+    LLM_USAGE_LOG_PATH,
+)
+from utils.metrics import Metrics
+
+if TYPE_CHECKING:
+    from llama_cpp import LlamaGrammar
+
+# llama_cpp, openai and httpx are imported by the backends that need them,
+# so FakeAPI and the benchmark run without them installed
 
 # import google.generativeai as genai
 import time
@@ -10,8 +39,233 @@ import time
 SYSTEM_PROMPT = """You are an smart being that like to plan your action"""
 
 
+@lru_cache(maxsize=64)
+def compile_grammar(grammar: str) -> "LlamaGrammar":
+    """Parse a GBNF grammar once; personas with the same targets share it."""
+    from llama_cpp import LlamaGrammar
+
+    return LlamaGrammar.from_string(grammar, verbose=False)
+
+
+def complete_json(text: str) -> Optional[str]:
+    """text up to the end of its first whole JSON object or array, if it has one."""
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return None
+    start = min(starts)
+    try:
+        _, end = json.JSONDecoder().raw_decode(text, start)
+    except json.JSONDecodeError:
+        return None
+    return text[:end]
+
+
+class UsageMeter:
+    """Prompt tokens, completion tokens and latency of every backend call.
+
+    Each call is appended as one CSV row to LLM_USAGE_LOG_PATH when set,
+    and added to running totals. Calls are also aggregated by Metrics and
+    written out every interval seconds, to LLM_METRICS_PATH when set.
+    """
+
+    def __init__(
+        self,
+        model: str = "",
+        metrics: Optional[Metrics] = None,
+        interval: float = LLM_METRICS_INTERVAL,
+        path: Optional[str] = LLM_USAGE_LOG_PATH,
+    ):
+        if metrics is None:
+            metrics = Metrics(
+                enabled=LLM_METRICS_PATH is not None, path=LLM_METRICS_PATH
+            )
+        self.model = model
+        self.metrics = metrics
+        self.interval = interval
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency = 0.0
+        self.last_log = time.monotonic()
+
+        self.file = None
+        self.writer = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            new_file = not os.path.exists(path)
+            self.file = open(path, "a", newline="")
+            self.writer = csv.writer(self.file)
+            if new_file:
+                self.writer.writerow(
+                    ["time", "model", "prompt_tokens", "completion_tokens", "latency"]
+                )
+
+    def record(self, prompt_tokens: int, completion_tokens: int, latency: float) -> None:
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.latency += latency
+        if self.writer is not None:
+            self.writer.writerow(
+                [time.time(), self.model, prompt_tokens, completion_tokens, latency]
+            )
+            self.file.flush()
+
+        self.metrics.record("llm_prompt_tokens", prompt_tokens)
+        self.metrics.record("llm_completion_tokens", completion_tokens)
+        self.metrics.record("llm_latency", latency)
+        now = time.monotonic()
+        if now - self.last_log >= self.interval:
+            self.metrics.log(self.calls)
+            self.last_log = now
+
+    def summary(self):
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "mean_latency": self.latency / self.calls if self.calls else 0.0,
+        }
+
+    def close(self) -> None:
+        if self.file:
+            self.file.close()
+        self.file = None
+        self.writer = None
+
+
+class BackendBusy(Exception):
+    """Raised when a backend already has max_pending requests waiting."""
+
+
+class RequestLimiter:
+    """Async concurrency limit with a bounded wait line.
+
+    At most max_concurrency requests run at once; up to max_pending more
+    wait for a slot and anything beyond that is rejected with BackendBusy
+    instead of piling up behind a slow backend.
+    """
+
+    def __init__(self, max_concurrency: int, max_pending: int = LLM_MAX_PENDING):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.running = 0
+        self.rejected = 0
+
+    async def __aenter__(self):
+        if self.semaphore.locked():
+            if self.waiting >= self.max_pending:
+                self.rejected += 1
+                raise BackendBusy(f"{self.waiting} requests already waiting")
+            self.waiting += 1
+            try:
+                await self.semaphore.acquire()
+            finally:
+                self.waiting -= 1
+        else:
+            await self.semaphore.acquire()
+        self.running += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self.running -= 1
+        self.semaphore.release()
+        return False
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+        }
+
+
+class ResponseCache:
+    """Content-addressed cache of LLM responses.
+
+    Keys hash the model, system prompt, user prompt and generation
+    parameters, so only requests that would produce the same output share
+    an entry. A bounded LRU lives in memory; an optional SQLite file keeps
+    entries across runs and refills the LRU on a memory miss.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, str] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT)"
+            )
+            self.db.commit()
+
+    @staticmethod
+    def key(model: str, system_prompt: str, user_prompt: str, **params) -> str:
+        payload = json.dumps(
+            [model, system_prompt, user_prompt, sorted(params.items())], default=str
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            response = self.entries.get(key)
+            if response is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return response
+
+            if self.db is not None:
+                row = self.db.execute(
+                    "SELECT response FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row:
+                    self._remember(key, row[0])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, response: str) -> None:
+        with self.lock:
+            self._remember(key, response)
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO responses (key, response) VALUES (?, ?)",
+                    (key, response),
+                )
+                self.db.commit()
+
+    def _remember(self, key: str, response: str) -> None:
+        self.entries[key] = response
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self.entries),
+        }
+
+
 class LocalAPI:
-    def __init__(self):
+    def __init__(self, cache: Optional[ResponseCache] = None):
+        from llama_cpp import Llama, LlamaRAMCache
+
         self.client = Llama(
             model_path=MODEL_PATH,
             # n_threads=8,
@@ -23,47 +277,221 @@ class LocalAPI:
             n_batch=226,
             seed=42,
         )
+        # one Llama context can only run one completion at a time, so the
+        # backend gets its own single worker instead of the loop's default
+        # pool; callers queue in the limiter rather than on the executor
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llama")
+        self.limiter = RequestLimiter(1)
+
+        # Keep evaluated KV state keyed by prompt tokens. Each request
+        # restores the longest cached prefix (system prompt, static
+        # instructions, the persona's own earlier context) and only
+        # evaluates the new suffix.
+        if PROMPT_CACHE_BYTES:
+            self.client.set_cache(LlamaRAMCache(capacity_bytes=PROMPT_CACHE_BYTES))
+
+        # temperature 0 and a fixed seed make responses a pure function of the prompt
+        self.cache = cache if cache else ResponseCache(path=RESPONSE_CACHE_PATH)
+        self.usage = UsageMeter(os.path.basename(MODEL_PATH))
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.client.tokenize(text.encode(), add_bos=False, special=True))
+
+    async def _create_chat_completion(self, **kwargs):
+        async with self.limiter:
+            loop = asyncio.get_running_loop()
+            # a timed-out completion still runs to the end in the worker;
+            # the next request simply waits for it on the executor
+            return await asyncio.wait_for(
+                loop.run_in_executor(
+                    self.executor,
+                    lambda: self.client.create_chat_completion(**kwargs),
+                ),
+                timeout=LLM_REQUEST_TIMEOUT,
+            )
+
+    @staticmethod
+    def _generation_params(grammar=None, max_tokens=None):
+        params = {}
+        if grammar:
+            # sampling only ever picks tokens the grammar allows
+            params["grammar"] = compile_grammar(grammar)
+        if max_tokens:
+            params["max_tokens"] = max_tokens
+        return params
+
+    def _cache_key(self, user_input, grammar=None, max_tokens=None, prefix=False):
+        """prefix keys hold streams closed after their first JSON value."""
+        params = {"stream_prefix": True} if prefix else {}
+        return self.cache.key(
+            MODEL_PATH,
+            SYSTEM_PROMPT,
+            user_input,
+            temperature=0,
+            grammar=grammar,
+            max_tokens=max_tokens,
+            **params,
+        )
 
-    async def get_response(self, user_input):
+    async def get_response(self, user_input, grammar=None, max_tokens=None):
 
         messages = [
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": user_input},
         ]
 
+        cache_key = self._cache_key(user_input, grammar, max_tokens)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         try:
-            loop = asyncio.get_event_loop()
             current = time.time()
 
-            response = await loop.run_in_executor(
-                None,  # None uses the default executor
-                lambda: self.client.create_chat_completion(
-                    messages=messages,
-                    temperature=0,
-                    # max_tokens=256,
-                    # repeat_penalty=1.1,
-                    # stop=["END"],
-                ),
+            response = await self._create_chat_completion(
+                messages=messages,
+                temperature=0,
+                **self._generation_params(grammar, max_tokens),
+                # repeat_penalty=1.1,
+                # stop=["END"],
             )
             ai_response = response["choices"][0]["message"]["content"].strip()
 
             print(f"Time taken: {time.time() - current}")
+            usage = response.get("usage") or {}
+            self.usage.record(
+                usage.get("prompt_tokens", 0),
+                usage.get("completion_tokens", 0),
+                time.time() - current,
+            )
 
+            self.cache.put(cache_key, ai_response)
             return ai_response
 
         except Exception as e:
             print(f"Error getting response: {e}")
             return "I'm having trouble connecting right now."
 
+    async def stream_response(self, user_input, grammar=None, max_tokens=None):
+        """Yield the completion as it is generated.
+
+        Closing the generator early stops generation at the next token.
+        Complete responses are cached. A response closed early is cached up
+        to its first whole JSON value, as callers stop as soon as the
+        decision object closes, under a key only streams read: get_response
+        must never be answered with a cut-off response.
+        """
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_input},
+        ]
+
+        cache_key = self._cache_key(user_input, grammar, max_tokens)
+        prefix_key = self._cache_key(user_input, grammar, max_tokens, prefix=True)
+        cached = self.cache.get(cache_key)
+        if cached is None:
+            cached = self.cache.get(prefix_key)
+        if cached is not None:
+            yield cached
+            return
+        params = self._generation_params(grammar, max_tokens)
+
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+
+        def generate():
+            try:
+                for chunk in self.client.create_chat_completion(
+                    messages=messages, temperature=0, stream=True, **params
+                ):
+                    if stop.is_set():
+                        break
+                    text = chunk["choices"][0]["delta"].get("content")
+                    if text:
+                        loop.call_soon_threadsafe(chunks.put_nowait, text)
+            except Exception as e:
+                loop.call_soon_threadsafe(chunks.put_nowait, e)
+                return
+            loop.call_soon_threadsafe(chunks.put_nowait, None)
+
+        parts = []
+        finished = False
+        current = time.time()
+        async with self.limiter:
+            future = loop.run_in_executor(self.executor, generate)
+            try:
+                while True:
+                    text = await asyncio.wait_for(
+                        chunks.get(), timeout=LLM_REQUEST_TIMEOUT
+                    )
+                    if text is None:
+                        break
+                    if isinstance(text, Exception):
+                        raise text
+                    parts.append(text)
+                    yield text
+                finished = True
+            finally:
+                response = "".join(parts).strip()
+                if finished:
+                    self.cache.put(cache_key, response)
+                else:
+                    # the chunk closing the object may run past it
+                    response = complete_json(response)
+                    if response is not None:
+                        self.cache.put(prefix_key, response)
+                stop.set()
+                await asyncio.gather(future, return_exceptions=True)
+                # llama.cpp streams one token per chunk
+                self.usage.record(
+                    self.count_tokens(SYSTEM_PROMPT + user_input),
+                    len(parts),
+                    time.time() - current,
+                )
+
 
 class OpenaiAPI:
-    def __init__(self, *args, **kwargs):
+    def __init__(
+        self,
+        *args,
+        base_url: Optional[str] = OPENAI_BASE_URL,
+        max_concurrency: int = LLM_MAX_IN_FLIGHT,
+        **kwargs,
+    ):
         self.system_prompt = """You are an smart being that like to plan your action"""
 
         self.model = "gpt-4o-mini"  # Using GPT-4 Mini model
-        self.client = self.load_api_key()
-
-    async def get_response(self, user_input, system_prompt=None):
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL")
+        self.limiter = RequestLimiter(max_concurrency)
+        self.client = self.load_api_key(self.base_url, max_concurrency)
+        self.usage = UsageMeter(self.model)
+        try:
+            import tiktoken
+
+            self.encoding = tiktoken.encoding_for_model(self.model)
+        except Exception:
+            self.encoding = None
+
+    def count_tokens(self, text: str) -> int:
+        if self.encoding is None:
+            # roughly four characters per token for English text
+            return len(text) // 4 + 1
+        return len(self.encoding.encode(text))
+
+    def _generation_params(self, grammar=None, max_tokens=None):
+        params = {}
+        # llama.cpp-compatible servers take a GBNF grammar as an extra
+        # field; the hosted API does not
+        if grammar and self.base_url:
+            params["extra_body"] = {"grammar": grammar}
+        if max_tokens:
+            params["max_tokens"] = max_tokens
+        return params
+
+    async def get_response(
+        self, user_input, system_prompt=None, grammar=None, max_tokens=None
+    ):
         if not system_prompt:
             system_prompt = self.system_prompt
 
@@ -73,14 +501,20 @@ class OpenaiAPI:
         ]
 
         try:
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,  # None uses the default executor
-                lambda: self.client.chat.completions.create(
-                    model=self.model, messages=messages
-                ),
-            )
+            current = time.time()
+            async with self.limiter:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    **self._generation_params(grammar, max_tokens),
+                )
             ai_response = response.choices[0].message.content
+            if response.usage:
+                self.usage.record(
+                    response.usage.prompt_tokens,
+                    response.usage.completion_tokens,
+                    time.time() - current,
+                )
 
             return ai_response
 
@@ -88,13 +522,60 @@ class OpenaiAPI:
             print(f"Error getting response: {e}")
             return "I'm having trouble connecting right now."
 
-    def load_api_key(self):
-        import os
+    async def stream_response(
+        self, user_input, system_prompt=None, grammar=None, max_tokens=None
+    ):
+        """Yield the completion as it is generated; closing it early drops the stream."""
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_input},
+        ]
+
+        parts = []
+        current = time.time()
+        async with self.limiter:
+            stream = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                **self._generation_params(grammar, max_tokens),
+            )
+            try:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+                        yield parts[-1]
+            finally:
+                # closing the connection stops generation server-side
+                await stream.close()
+                self.usage.record(
+                    self.count_tokens(SYSTEM_PROMPT + user_input),
+                    self.count_tokens("".join(parts)),
+                    time.time() - current,
+                )
+
+    def load_api_key(self, base_url=None, max_connections=LLM_MAX_IN_FLIGHT):
+        import httpx
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 
         try:
             api_key = os.getenv("OPENAI_API_KEY")
-            if api_key:
-                client = OpenAI(api_key=api_key)  # Initialize client with API key
+            base_url = base_url or os.getenv("OPENAI_BASE_URL")
+            if api_key or base_url:
+                # one pooled keep-alive client per backend; the SDK retries
+                # connection errors, 429 and 5xx with backoff
+                client = AsyncOpenAI(
+                    api_key=api_key or "unused",  # local servers ignore the key
+                    base_url=base_url,
+                    timeout=LLM_REQUEST_TIMEOUT,
+                    max_retries=LLM_MAX_RETRIES,
+                    http_client=DefaultAsyncHttpxClient(
+                        limits=httpx.Limits(
+                            max_connections=max_connections,
+                            max_keepalive_connections=max_connections,
+                        )
+                    ),
+                )
                 return client
             else:
                 print("Error: OPENAI_API_KEY not found in environment variables")
@@ -104,6 +585,40 @@ class OpenaiAPI:
             return None
 
 
+_shared_apis = {}
+
+
+def get_api(model="gpt"):
+    """Backend shared by every persona using the same model.
+
+    Sharing lets concurrent requests be merged into batches and keeps a
+    local model loaded once instead of once per NPC.
+    """
+    from scheduler import PromptBatcher
+
+    if model not in _shared_apis:
+        if model == "gpt":
+            api = OpenaiAPI()
+        elif model == "local":
+            api = LocalAPI()
+        elif model == "fake":
+            from fake_api import FakeAPI
+
+            api = FakeAPI()
+        else:
+            raise ValueError(f"Unknown model: {model}")
+        _shared_apis[model] = PromptBatcher(api)
+    return _shared_apis[model]
+
+
+def set_api(model, api):
+    """Share api under model from now on, e.g. a FakeAPI in benchmarks."""
+    from scheduler import PromptBatcher
+
+    _shared_apis[model] = PromptBatcher(api)
+    return _shared_apis[model]
+
+
 # class GeminiAPI:
 #     def __init__(self, *args, **kwargs):
 #         self.system_prompt = """You are an smart being that like to plan your action"""
@@ -0,0 +1,106 @@
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from ai.numpy_policy import NumpyPolicy
+
+if TYPE_CHECKING:
+    from environment.env import Environment
+    from entities.creature import Creature
+
+History = Tuple[str, str, Optional[str], object]
+
+
+def neighbour_counts(mask: np.ndarray) -> np.ndarray:
+    """Number of true cells among the 8 neighbours of every cell."""
+    h, w = mask.shape
+    padded = np.pad(mask.astype(np.int8), 1)
+    return sum(
+        padded[1 + dy : 1 + dy + h, 1 + dx : 1 + dx + w]
+        for dy in (-1, 0, 1)
+        for dx in (-1, 0, 1)
+        if dx or dy
+    )
+
+
+class BatchAI:
+    """Controller that picks actions for every live creature in one call.
+
+    Subclasses implement choose_actions(); step() builds the batched
+    observations, asks for one action per creature and applies them in order.
+    """
+
+    def choose_actions(
+        self,
+        obs: Dict[str, np.ndarray],
+        creatures: List["Creature"],
+        env: "Environment",
+    ) -> np.ndarray:
+        raise NotImplementedError
+
+    def step(self, creatures: List["Creature"], env: "Environment") -> List[History]:
+        obs = env.observations(creatures)
+        actions = self.choose_actions(obs, creatures, env)
+
+        history = []
+        for c, action_int in zip(creatures, actions):
+            # an earlier creature in this tick may already have killed it
+            if c.stats.hp <= 0:
+                continue
+            action = env.int_to_action[int(action_int)]
+            target = env.select_target(c, action)
+            result, _ = env.actions.set_action(action, c=c, target=target, env=env)
+            history.append((c.id, action, target.id if target else None, result))
+        return history
+
+
+class RuleBasedAI(BatchAI):
+    """Vectorised survival rules: eat when hurt, breed when rested, else fight or wander."""
+
+    def __init__(self, low_hp: float = 0.5, critical_hp: float = 0.3):
+        self.low_hp = low_hp
+        self.critical_hp = critical_hp
+
+    def choose_actions(self, obs, creatures, env):
+        action_to_int = {action: i for i, action in env.int_to_action.items()}
+        n = len(creatures)
+
+        hp = np.array([c.stats.hp for c in creatures], dtype=np.float64)
+        max_hp = np.array([c.stats.max_hp for c in creatures], dtype=np.float64)
+        energy = np.array([c.stats.energy for c in creatures], dtype=np.float64)
+        max_energy = np.array([c.stats.max_energy for c in creatures], dtype=np.float64)
+        x, y = np.array([c.location for c in creatures], dtype=np.int64).reshape(n, 2).T
+
+        near_creature = neighbour_counts((env.type_grid == 1) | (env.type_grid == 2))
+        near_resource = neighbour_counts(env.type_grid == 3)
+        has_creature = near_creature[y, x] > 0
+        has_resource = near_resource[y, x] > 0
+
+        moves = env.rngs["ai"].integers(0, 4, size=n)  # move_up .. move_right
+
+        conditions = [
+            (hp < self.low_hp * max_hp) & has_resource,
+            (hp < self.critical_hp * max_hp) & (energy > 0),
+            has_creature & (energy >= max_energy / 2),
+            has_resource,
+            has_creature & (energy > 0),
+        ]
+        choices = [
+            action_to_int["harvest"],
+            action_to_int["heal_self"],
+            action_to_int["reproduce"],
+            action_to_int["harvest"],
+            action_to_int["attack"],
+        ]
+        return np.select(conditions, choices, default=moves)
+
+
+class PolicyAI(BatchAI):
+    """Learned policy backend running an exported NumpyPolicy."""
+
+    def __init__(self, policy: Union[str, NumpyPolicy], deterministic: bool = False):
+        self.policy = NumpyPolicy.load(policy) if isinstance(policy, str) else policy
+        self.deterministic = deterministic
+
+    def choose_actions(self, obs, creatures, env):
+        return self.policy.act(obs, deterministic=self.deterministic, rng=env.rngs["ai"])
@@ -0,0 +1,210 @@
+"""Offline throughput and tail-latency benchmark of NPC decisions.
+
+Simulates npcs NPCs that each ask for decisions one after another through
+the game's own Persona, DecisionBatcher, PromptBatcher and LLMScheduler,
+against either the in-process FakeAPI or OpenaiAPI talking to the mock
+HTTP server, both with injected latency and failures. Nothing touches a
+real model or the network. Run from code/ with code, ai, utils and game
+on PYTHONPATH, like the game:
+
+    python ai/benchmark.py --npcs 20 --decisions 5 --max-in-flight 4
+"""
+
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import random
+import tempfile
+import time
+from contextlib import redirect_stdout
+from typing import Any, Dict, List
+
+import numpy as np
+
+from settings import (
+    FPS,
+    LLM_MAX_IN_FLIGHT,
+    LLM_DEADLINE,
+    MEMORY_SIZE,
+    DECISION_BATCH_SIZE,
+)
+from api import OpenaiAPI, set_api
+from fake_api import FakeAPI, LatencyModel
+from memstream import JsonlStore, MemoryStream
+from persona import DecisionBatcher, Persona
+from scheduler import LLMScheduler
+
+CHARACTERISTICS = ("aggressive", "friendly and likes to help", "cautious")
+
+
+class SimulatedNPC:
+    """Just enough of an Enemy for Persona.fetch_decision."""
+
+    def __init__(self, index: int, count: int, persona: Persona, distance: float):
+        self.full_name = f"npc_{index}"
+        self.characteristic = CHARACTERISTICS[index % len(CHARACTERISTICS)]
+        self.persona = persona
+        self.distance = distance
+        self.neighbours = [f"npc_{(index + d) % count}" for d in (-1, 1) if count > 1]
+        self.task = None
+        self.issued = 0
+        self.step = 0
+
+    def busy(self) -> bool:
+        return (
+            self.task is not None
+            and inspect.getcoroutinestate(self.task) != inspect.CORO_CLOSED
+        )
+
+    def observe(self, memory: MemoryStream) -> None:
+        """Log a synthetic observation, as Enemy.save_observation would."""
+        self.step += 1
+        hp = max(10, 100 - 7 * self.step)
+        others = [
+            self._entity(name, 80, "attack", self.full_name) for name in self.neighbours
+        ]
+        others.append(self._entity("player", 100, "attack", self.full_name))
+        entry: Dict[str, Any] = {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "self": self._entity(self.full_name, hp, "idle", "None"),
+            "nearby_entities": others,
+            "nearby_objects": [
+                {"object_name": f"tree_{self.step % 3}", "location": {"x": 0, "y": 0}}
+            ],
+        }
+        entry["self"]["observations"]["event"] = f"attacked by player {self.step}"
+        filename = f"stream_{self.full_name}.json"
+        memory.write_memory(entry, filename, threshold=MEMORY_SIZE)
+        self.persona.remember(entry)
+
+    def _entity(self, name: str, hp: int, action: str, target: str) -> Dict[str, Any]:
+        return {
+            "entity_name": name,
+            "action": action,
+            "target_name": target,
+            "observations": {"intention": action, "event": None, "observed": None},
+            "location": {"x": 0, "y": 0},
+            "stats": {"health": f"{hp}/100", "energy": "50/100", "experience": 0},
+        }
+
+
+async def timed_decision(npc: SimulatedNPC, queued: float, latencies: List[float]):
+    # never runs if the scheduler drops it as expired before starting
+    before = npc.persona.decisions
+    await npc.persona.fetch_decision(npc)
+    if npc.persona.decisions > before:
+        latencies.append(time.monotonic() - queued)
+
+
+async def simulate(args, api) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    scheduler = LLMScheduler(max_in_flight=args.max_in_flight, deadline=args.deadline)
+    memory = MemoryStream(JsonlStore(tempfile.mkdtemp(prefix="benchmark_memory_")))
+    batcher = None
+    if args.batch_size > 1:
+        batcher = DecisionBatcher(api, size=args.batch_size)
+
+    npcs = []
+    for i in range(args.npcs):
+        persona = Persona(model=args.backend, memory=memory)
+        persona.batcher = batcher
+        npcs.append(SimulatedNPC(i, args.npcs, persona, rng.uniform(0, 400)))
+
+    latencies: List[float] = []
+    start = time.monotonic()
+    while True:
+        for npc in npcs:
+            if npc.busy() or npc.issued == args.decisions:
+                continue
+            npc.observe(memory)
+            npc.task = timed_decision(npc, time.monotonic(), latencies)
+            npc.issued += 1
+            scheduler.put(npc.distance, npc.task)
+        scheduler.pump()
+        if all(npc.issued == args.decisions and not npc.busy() for npc in npcs):
+            break
+        await asyncio.sleep(1.0 / FPS)
+    elapsed = time.monotonic() - start
+    scheduler.pump()
+    memory.close()
+
+    backend = api.api
+    requested = args.npcs * args.decisions
+    report = {
+        "npcs": args.npcs,
+        "requested": requested,
+        "decided": len(latencies),
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "scheduler": scheduler.stats(),
+        "backend": (
+            backend.stats() if hasattr(backend, "stats") else backend.limiter.stats()
+        ),
+    }
+    if latencies:
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        report["latency"] = {
+            "p50": p50,
+            "p95": p95,
+            "p99": p99,
+            "max": max(latencies),
+        }
+    if batcher is not None:
+        report["batches"] = {"calls": batcher.calls, "decisions": batcher.decisions}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", choices=("fake", "mock"), default="fake")
+    parser.add_argument("--npcs", type=int, default=10)
+    parser.add_argument("--decisions", type=int, default=5, help="per NPC")
+    parser.add_argument("--distribution", default="lognormal")
+    parser.add_argument("--first-token", type=float, default=0.2)
+    parser.add_argument("--spread", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--concurrency", type=int, default=1, help="requests the backend serves at once"
+    )
+    parser.add_argument("--max-in-flight", type=int, default=LLM_MAX_IN_FLIGHT)
+    parser.add_argument("--deadline", type=float, default=LLM_DEADLINE)
+    parser.add_argument("--batch-size", type=int, default=DECISION_BATCH_SIZE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="keep persona output")
+    args = parser.parse_args()
+
+    latency = LatencyModel(
+        args.distribution,
+        args.first_token,
+        args.spread,
+        args.tokens_per_second,
+        args.failure_rate,
+        args.seed,
+    )
+    server = None
+    if args.backend == "fake":
+        api = set_api("fake", FakeAPI(latency, max_concurrency=args.concurrency))
+    else:
+        from mock_server import base_url, start_server
+
+        server = start_server(latency=latency)
+        url = base_url(server)
+        api = set_api("mock", OpenaiAPI(base_url=url, max_concurrency=args.concurrency))
+
+    try:
+        if args.verbose:
+            report = asyncio.run(simulate(args, api))
+        else:
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                report = asyncio.run(simulate(args, api))
+    finally:
+        if server is not None:
+            server.shutdown()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import glob
+import os
+import queue
+import random
+import threading
+from typing import Any, Dict, Optional
+
+import numpy as np
+import torch
+
+
+def clone_state(state):
+    """Detached CPU copy of a (nested) state dict, safe to write from another thread."""
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        return {key: clone_state(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(clone_state(value) for value in state)
+    return state
+
+
+def rng_state() -> Dict[str, Any]:
+    return {
+        "torch": torch.get_rng_state(),
+        "numpy": np.random.get_state(),
+        "random": random.getstate(),
+    }
+
+
+def set_rng_state(state: Dict[str, Any]) -> None:
+    torch.set_rng_state(state["torch"])
+    np.random.set_state(state["numpy"])
+    random.setstate(state["random"])
+
+
+def atomic_save(state, path: str) -> None:
+    tmp_path = f"{path}.tmp"
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class CheckpointWriter:
+    """Writes training checkpoints from a background thread.
+
+    save() snapshots the model, optimiser and RNG state on the caller's
+    thread (a cheap tensor copy) and queues the write, so rollouts keep
+    going while the file is serialised. Files are written to a temp name
+    and renamed into place; only the newest keep_last are kept.
+    """
+
+    def __init__(
+        self,
+        directory: str = "checkpoints",
+        prefix: str = "checkpoint",
+        keep_last: int = 3,
+        every: int = 1,
+    ):
+        self.directory = directory
+        self.prefix = prefix
+        self.keep_last = keep_last
+        self.every = every
+        self.calls = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.queue = queue.Queue()
+        self.error: Optional[Exception] = None
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def path(self, step: int) -> str:
+        return os.path.join(self.directory, f"{self.prefix}_{step:012d}.pt")
+
+    def checkpoints(self):
+        return sorted(glob.glob(os.path.join(self.directory, f"{self.prefix}_*.pt")))
+
+    def latest(self) -> Optional[str]:
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if checkpoints else None
+
+    def maybe_save(self, step: int, model, optimizer=None, extra=None) -> bool:
+        """Save on every `every`-th call."""
+        self.calls += 1
+        if self.calls % self.every:
+            return False
+        self.save(step, model, optimizer, extra)
+        return True
+
+    def save(self, step: int, model, optimizer=None, extra=None) -> None:
+        self._raise_error()
+        state = {
+            "step": step,
+            "model": clone_state(model.state_dict()),
+            "optimizer": clone_state(optimizer.state_dict()) if optimizer else None,
+            "rng": rng_state(),
+            "extra": extra or {},
+        }
+        self.queue.put((self.path(step), state, True))
+
+    def export(self, path: str, model) -> None:
+        """Write a bare state dict (e.g. the best model) without blocking."""
+        self._raise_error()
+        self.queue.put((path, clone_state(model.state_dict()), False))
+
+    def load_latest(self, model, optimizer=None) -> Optional[Dict[str, Any]]:
+        """Restore model, optimiser and RNG state from the newest checkpoint."""
+        path = self.latest()
+        if path is None:
+            return None
+        state = torch.load(path, weights_only=False)
+        model.load_state_dict(state["model"])
+        if optimizer is not None and state["optimizer"] is not None:
+            optimizer.load_state_dict(state["optimizer"])
+        set_rng_state(state["rng"])
+        print(f"Resumed from {path}")
+        return state
+
+    def flush(self) -> None:
+        self.queue.join()
+        self._raise_error()
+
+    def close(self) -> None:
+        self.flush()
+        self.queue.put(None)
+        self.worker.join()
+
+    def _raise_error(self) -> None:
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _prune(self) -> None:
+        for path in self.checkpoints()[: -self.keep_last]:
+            os.remove(path)
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            path, state, rolling = item
+            try:
+                atomic_save(state, path)
+                if rolling:
+                    self._prune()
+            except Exception as e:
+                print(f"Error writing checkpoint {path}: {e}")
+                self.error = e
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,60 @@
+import argparse
+
+import numpy as np
+import torch.nn as nn
+from stable_baselines3 import PPO
+
+
+def linear_layers(module: nn.Sequential):
+    weights = []
+    activation = None
+    for layer in module:
+        if isinstance(layer, nn.Linear):
+            weights.append(linear(layer))
+        elif isinstance(layer, nn.Tanh):
+            activation = "tanh"
+        elif isinstance(layer, nn.ReLU):
+            activation = "relu"
+        else:
+            raise ValueError(f"Cannot export layer {layer}")
+    return weights, activation
+
+
+def linear(layer: nn.Linear):
+    # stored as (in, out) so the runtime computes x @ w + b
+    weight = layer.weight.detach().cpu().numpy().T.astype(np.float32)
+    bias = layer.bias.detach().cpu().numpy().astype(np.float32)
+    return weight, bias
+
+
+def export_sb3_policy(model_path: str, out_path: str) -> str:
+    """Convert a stable_baselines3 MultiInputPolicy PPO into NumPy arrays for NumpyPolicy."""
+    model = PPO.load(model_path, device="cpu")
+    policy = model.policy
+
+    policy_layers, activation = linear_layers(policy.mlp_extractor.policy_net)
+    value_layers, _ = linear_layers(policy.mlp_extractor.value_net)
+
+    arrays = {
+        # CombinedExtractor concatenates in observation space key order
+        "obs_keys": np.array(list(model.observation_space.spaces.keys())),
+        "activation": np.array(activation or "tanh"),
+    }
+    for prefix, layers in (("pi", policy_layers), ("vf", value_layers)):
+        for i, (weight, bias) in enumerate(layers):
+            arrays[f"{prefix}_w{i}"] = weight
+            arrays[f"{prefix}_b{i}"] = bias
+    arrays["action_w"], arrays["action_b"] = linear(policy.action_net)
+    arrays["value_w"], arrays["value_b"] = linear(policy.value_net)
+
+    np.savez(out_path, **arrays)
+    print(f"Exported {model_path} to {out_path}")
+    return out_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model", nargs="?", default="ppo_best_model.zip")
+    parser.add_argument("out", nargs="?", default="ppo_best_model.npz")
+    args = parser.parse_args()
+    export_sb3_policy(args.model, args.out)
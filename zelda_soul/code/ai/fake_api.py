@@ -0,0 +1,175 @@
+import asyncio
+import json
+import re
+import threading
+from typing import Callable, List, Optional
+
+import numpy as np
+
+# decision the stand-in gives every NPC; valid whatever the targets are
+MOCK_DECISION = {
+    "action": "runaway",
+    "target_name": "None",
+    "vigilant": 50,
+    "reason": "mock decision",
+}
+# NPC headers of a batched decision prompt
+BATCH_NPC = re.compile(r"NPC (.+?), who is")
+
+
+def mock_response(user_input: str) -> str:
+    """Well-formed answer to a persona prompt, single or batched."""
+    names = BATCH_NPC.findall(user_input)
+    if names:
+        return json.dumps([{"full_name": name, **MOCK_DECISION} for name in names])
+    return json.dumps(MOCK_DECISION)
+
+
+class LatencyModel:
+    """Time to first token, token rate and failures of a simulated backend.
+
+    first_token is the mean delay before the first token. The delay is
+    drawn from a "constant", "uniform", "exponential" or "lognormal"
+    distribution; spread is the lognormal sigma. A failure_rate fraction
+    of requests fail after the first-token delay.
+    """
+
+    def __init__(
+        self,
+        distribution: str = "lognormal",
+        first_token: float = 0.2,
+        spread: float = 0.5,
+        tokens_per_second: float = 50.0,
+        failure_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        if distribution not in ("constant", "uniform", "exponential", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        self.distribution = distribution
+        self.first_token = first_token
+        self.spread = spread
+        self.tokens_per_second = tokens_per_second
+        self.failure_rate = failure_rate
+        self.rng = np.random.default_rng(seed)
+        # the HTTP stub samples from several handler threads
+        self.lock = threading.Lock()
+
+    def first_token_delay(self) -> float:
+        with self.lock:
+            if self.distribution == "constant":
+                return self.first_token
+            if self.distribution == "uniform":
+                return float(self.rng.uniform(0.0, 2.0 * self.first_token))
+            if self.distribution == "exponential":
+                return float(self.rng.exponential(self.first_token))
+            # mean-preserving lognormal
+            return float(
+                self.first_token
+                * np.exp(self.spread * self.rng.standard_normal() - self.spread**2 / 2)
+            )
+
+    def token_delay(self) -> float:
+        return 1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def fails(self) -> bool:
+        with self.lock:
+            return bool(self.rng.random() < self.failure_rate)
+
+
+def split_tokens(text: str, max_tokens: Optional[int] = None) -> List[str]:
+    """Roughly four characters per token, like the OpenaiAPI estimate."""
+    tokens = [text[i : i + 4] for i in range(0, len(text), 4)]
+    return tokens[:max_tokens] if max_tokens else tokens
+
+
+class FakeAPI:
+    """In-process stand-in for LocalAPI/OpenaiAPI with injected latency.
+
+    Same get_response(s)/stream_response/count_tokens surface as the real
+    backends, answering every prompt with responder(user_input) streamed
+    at the latency model's token rate. Runs up to max_concurrency requests
+    at once; 1 behaves like a single llama.cpp context.
+    """
+
+    def __init__(
+        self,
+        latency: Optional[LatencyModel] = None,
+        responder: Callable[[str], str] = mock_response,
+        max_concurrency: int = 1,
+    ):
+        self.latency = latency if latency is not None else LatencyModel()
+        self.responder = responder
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.calls = 0
+        self.failures = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def count_tokens(self, text: str) -> int:
+        return len(text) // 4 + 1
+
+    async def get_response(
+        self, user_input, grammar=None, max_tokens=None, **kwargs
+    ):
+        stream = self.stream_response(user_input, max_tokens=max_tokens)
+        try:
+            return "".join([chunk async for chunk in stream])
+        except ConnectionError as e:
+            print(f"Error getting response: {e}")
+            return "I'm having trouble connecting right now."
+
+    async def get_responses(
+        self, user_inputs, grammar=None, max_tokens=None, **kwargs
+    ):
+        """Prompts merged by PromptBatcher, decoded together in one slot.
+
+        Models a backend with batched decoding: one first-token delay for
+        the batch, then every answer at the token rate at once, so the
+        batch takes as long as its longest answer.
+        """
+        async with self.semaphore:
+            await asyncio.sleep(self.latency.first_token_delay())
+            responses, longest = [], 0
+            for user_input in user_inputs:
+                self.calls += 1
+                self.prompt_tokens += self.count_tokens(user_input)
+                if self.latency.fails():
+                    self.failures += 1
+                    print("Error getting response: injected backend failure")
+                    responses.append("I'm having trouble connecting right now.")
+                    continue
+                tokens = split_tokens(self.responder(user_input), max_tokens)
+                self.completion_tokens += len(tokens)
+                longest = max(longest, len(tokens))
+                responses.append("".join(tokens))
+            await asyncio.sleep(longest * self.latency.token_delay())
+        return responses
+
+    async def stream_response(
+        self, user_input, grammar=None, max_tokens=None, **kwargs
+    ):
+        async with self.semaphore:
+            async for chunk in self._generate(user_input, max_tokens):
+                yield chunk
+
+    async def _generate(self, user_input, max_tokens=None):
+        self.calls += 1
+        self.prompt_tokens += self.count_tokens(user_input)
+        await asyncio.sleep(self.latency.first_token_delay())
+        if self.latency.fails():
+            self.failures += 1
+            raise ConnectionError("injected backend failure")
+
+        delay = self.latency.token_delay()
+        for token in split_tokens(self.responder(user_input), max_tokens):
+            self.completion_tokens += 1
+            yield token
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
@@ -0,0 +1,109 @@
+from typing import Any, Dict, List, Optional
+
+from settings import FALLBACK_LOW_HP
+from utils.metrics import Metrics, NULL_METRICS
+
+HOSTILE_WORDS = ("aggressive", "enemy")
+FRIENDLY_WORDS = ("friend", "help")
+
+
+def _fraction(value: str) -> float:
+    current, _, maximum = str(value).partition("/")
+    try:
+        return float(current) / float(maximum)
+    except (ValueError, ZeroDivisionError):
+        return 1.0
+
+
+def _distance(a: Dict[str, Any], b: Dict[str, Any]) -> float:
+    ax, ay = a["location"]["x"], a["location"]["y"]
+    bx, by = b["location"]["x"], b["location"]["y"]
+    return ((ax - bx) ** 2 + (ay - by) ** 2) ** 0.5
+
+
+class FallbackPolicy:
+    """Instant heuristic decision while the LLM one is queued or running.
+
+    decide() reads the same observation entry the persona is prompted
+    with (own hp, nearby entities and objects) plus the NPC's
+    characteristic and returns a decision dict in the LLM's format, so
+    Enemy.set_decision takes either. Subclass and override decide() to
+    plug in another policy.
+    """
+
+    def __init__(
+        self,
+        low_hp: float = FALLBACK_LOW_HP,
+        metrics: Optional[Metrics] = None,
+    ):
+        self.low_hp = low_hp
+        self.metrics = metrics if metrics is not None else NULL_METRICS
+        self.fallback_decisions = 0
+        self.llm_decisions = 0
+
+    def decide(self, entry: Dict[str, Any], characteristic: str) -> Dict[str, Any]:
+        me = entry["self"]
+        name = me["entity_name"]
+        hp = _fraction(me["stats"]["health"])
+        hostile = any(word in characteristic for word in HOSTILE_WORDS)
+        friendly = any(word in characteristic for word in FRIENDLY_WORDS)
+
+        others: List[Dict[str, Any]] = sorted(
+            entry["nearby_entities"], key=lambda other: _distance(me, other)
+        )
+        attackers = [
+            o for o in others if o["target_name"] == name and o["action"] == "attack"
+        ]
+        players = [o for o in others if "player" in o["entity_name"].lower()]
+
+        if hp < self.low_hp and (attackers or others):
+            return self._decision("runaway", (attackers or others)[0], 90, "too hurt")
+        if attackers:
+            if hostile or hp >= 0.5:
+                return self._decision("attack", attackers[0], 80, "fight back")
+            return self._decision("runaway", attackers[0], 80, "under attack")
+        if hostile and players:
+            return self._decision("attack", players[0], 60, "hunt player")
+        if friendly:
+            hurt = [o for o in others if _fraction(o["stats"]["health"]) < 0.5]
+            if hurt:
+                return self._decision("heal", hurt[0], 40, "help ally")
+        if entry["nearby_objects"]:
+            target = min(entry["nearby_objects"], key=lambda obj: _distance(me, obj))
+            return self._decision("mine", target, 10, "gather", key="object_name")
+        return {"action": "idle", "target_name": "None", "vigilant": 0, "reason": "wander"}
+
+    def _decision(self, action, target, vigilant, reason, key="entity_name"):
+        return {
+            "action": action,
+            "target_name": target[key],
+            "vigilant": vigilant,
+            "reason": reason,
+        }
+
+    def record_fallback(self) -> None:
+        self.fallback_decisions += 1
+        self.metrics.count("fallback_decisions")
+
+    def record_llm(self) -> None:
+        self.llm_decisions += 1
+        self.metrics.count("llm_decisions")
+
+    def stats(self) -> Dict[str, float]:
+        total = self.fallback_decisions + self.llm_decisions
+        return {
+            "fallback": self.fallback_decisions,
+            "llm": self.llm_decisions,
+            "fallback_rate": self.fallback_decisions / total if total else 0.0,
+        }
+
+
+_shared_policy: Optional[FallbackPolicy] = None
+
+
+def get_fallback_policy() -> FallbackPolicy:
+    """Policy shared by every enemy, so its counters cover the whole level."""
+    global _shared_policy
+    if _shared_policy is None:
+        _shared_policy = FallbackPolicy()
+    return _shared_policy
@@ -0,0 +1,169 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+from fake_api import LatencyModel, mock_response, split_tokens
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """OpenAI-compatible /v1/chat/completions, plain or streamed as SSE.
+
+    Speaks HTTP/1.1 so clients keep their connections alive; every
+    response is framed by Content-Length, or chunked when streamed.
+    """
+
+    protocol_version = "HTTP/1.1"
+    latency: LatencyModel
+    responder: Callable[[str], str]
+
+    def do_POST(self):
+        # read the body even when rejecting, so the connection stays usable
+        raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"No route {self.path}"}})
+            return
+        body = json.loads(raw)
+        prompt = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+
+        time.sleep(self.latency.first_token_delay())
+        if self.latency.fails():
+            self._send_json(500, {"error": {"message": "injected backend failure"}})
+            return
+
+        model = body.get("model", "mock")
+        tokens = split_tokens(self.responder(prompt), body.get("max_tokens"))
+        delay = self.latency.token_delay()
+        try:
+            if body.get("stream"):
+                self._stream(model, tokens, delay)
+            else:
+                time.sleep(delay * len(tokens))
+                self._send_json(200, self._completion(model, prompt, tokens))
+        except (BrokenPipeError, ConnectionResetError):
+            # client closed the stream early
+            pass
+
+    def _stream(self, model, tokens, delay):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, token in enumerate(tokens):
+            last = i == len(tokens) - 1
+            chunk = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"role": "assistant", "content": token},
+                        "finish_reason": "stop" if last else None,
+                    }
+                ],
+            }
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+            time.sleep(delay)
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data: bytes):
+        # an empty chunk ends the response
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _completion(self, model, prompt, tokens):
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": len(prompt) // 4 + 1,
+                "completion_tokens": len(tokens),
+                "total_tokens": len(prompt) // 4 + 1 + len(tokens),
+            },
+        }
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(
+    host: str = "127.0.0.1",
+    port: int = 0,
+    latency: Optional[LatencyModel] = None,
+    responder: Callable[[str], str] = mock_response,
+) -> ThreadingHTTPServer:
+    """Server on host:port (0 picks a free port); base_url is http://host:port/v1."""
+    handler = type(
+        "ConfiguredMockHandler",
+        (MockHandler,),
+        {
+            "latency": latency if latency is not None else LatencyModel(),
+            "responder": staticmethod(responder),
+        },
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_server(**kwargs) -> ThreadingHTTPServer:
+    """make_server() serving from a daemon thread; call shutdown() to stop."""
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def base_url(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--distribution", default="lognormal")
+    parser.add_argument("--first-token", type=float, default=0.2)
+    parser.add_argument("--spread", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = make_server(
+        args.host,
+        args.port,
+        LatencyModel(
+            args.distribution,
+            args.first_token,
+            args.spread,
+            args.tokens_per_second,
+            args.failure_rate,
+            args.seed,
+        ),
+    )
+    print(f"Mock LLM server on {base_url(server)}")
+    server.serve_forever()
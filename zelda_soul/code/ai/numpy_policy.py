@@ -0,0 +1,95 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+ACTIVATIONS = {
+    "tanh": np.tanh,
+    "relu": lambda x: np.maximum(x, 0.0),
+}
+
+Layer = Tuple[np.ndarray, np.ndarray]
+
+
+class NumpyPolicy:
+    """Pure NumPy forward pass of an exported PPO actor-critic.
+
+    Loads the .npz written by ai/export_policy.py, so game code can pick
+    actions for a whole batch of creatures without importing torch.
+    """
+
+    def __init__(
+        self,
+        obs_keys: List[str],
+        policy_layers: List[Layer],
+        action_layer: Layer,
+        value_layers: Optional[List[Layer]] = None,
+        value_layer: Optional[Layer] = None,
+        activation: str = "tanh",
+    ):
+        self.obs_keys = obs_keys
+        self.policy_layers = policy_layers
+        self.action_layer = action_layer
+        self.value_layers = value_layers
+        self.value_layer = value_layer
+        self.activation = ACTIVATIONS[activation]
+        self.n_actions = action_layer[0].shape[1]
+
+    @classmethod
+    def load(cls, path: str) -> "NumpyPolicy":
+        data = np.load(path)
+
+        def layers(prefix: str) -> List[Layer]:
+            result = []
+            while f"{prefix}_w{len(result)}" in data:
+                i = len(result)
+                result.append((data[f"{prefix}_w{i}"], data[f"{prefix}_b{i}"]))
+            return result
+
+        value_layers = layers("vf")
+        return cls(
+            obs_keys=[str(key) for key in data["obs_keys"]],
+            policy_layers=layers("pi"),
+            action_layer=(data["action_w"], data["action_b"]),
+            value_layers=value_layers,
+            value_layer=(data["value_w"], data["value_b"]) if "value_w" in data else None,
+            activation=str(data["activation"]),
+        )
+
+    def features(self, obs: Dict[str, np.ndarray]) -> np.ndarray:
+        """Flatten and concatenate a batch of dict observations, (B, n_features)."""
+        parts = []
+        for key in self.obs_keys:
+            value = np.asarray(obs[key], dtype=np.float32)
+            parts.append(value.reshape(value.shape[0], -1))
+        return np.concatenate(parts, axis=1)
+
+    def _mlp(self, x: np.ndarray, layers: List[Layer]) -> np.ndarray:
+        for weight, bias in layers:
+            x = self.activation(x @ weight + bias)
+        return x
+
+    def logits(self, obs: Dict[str, np.ndarray]) -> np.ndarray:
+        weight, bias = self.action_layer
+        return self._mlp(self.features(obs), self.policy_layers) @ weight + bias
+
+    def value(self, obs: Dict[str, np.ndarray]) -> np.ndarray:
+        weight, bias = self.value_layer
+        return (self._mlp(self.features(obs), self.value_layers) @ weight + bias)[:, 0]
+
+    def act(
+        self,
+        obs: Dict[str, np.ndarray],
+        deterministic: bool = True,
+        rng: Optional[np.random.Generator] = None,
+    ) -> np.ndarray:
+        """One action per row of the batch."""
+        logits = self.logits(obs)
+        if deterministic:
+            return logits.argmax(axis=1)
+
+        rng = rng if rng is not None else np.random.default_rng()
+        logits = logits - logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        cumulative = np.cumsum(probs, axis=1)
+        draws = rng.random((len(probs), 1)) * cumulative[:, -1:]
+        return (cumulative < draws).sum(axis=1)
@@ -1,56 +1,357 @@
-from memstream import MemoryStream
+from memstream import get_memory_stream
+import asyncio
 import json
-from typing import TYPE_CHECKING
-from settings import MEMORY_SIZE
-from api import OpenaiAPI, LocalAPI
+import re
+from contextlib import aclosing
+from typing import TYPE_CHECKING, Dict, List, Tuple
+from settings import (
+    SUMMARY_SIZE,
+    RETRIEVAL_K,
+    CONTEXT_LENGTH,
+    DECISION_BATCH_SIZE,
+    DECISION_BATCH_WAIT,
+)
+from retrieval import MemoryIndex, observation_text
+from api import get_api
+from prompt_budget import PromptBudget
 import time
 
 if TYPE_CHECKING:
     from enemy import Enemy
 
 
+ENTITY_ACTIONS = ("attack", "runaway", "heal")
+RESOURCE_ACTIONS = ("mine",)
+REASON_WORDS = 5
+REASON_WORD_LENGTH = 12
+
+
+def _gbnf_literal(text: str) -> str:
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _alternatives(values) -> str:
+    return " | ".join(_gbnf_literal(json.dumps(v)) for v in values)
+
+
+VIGILANT_SEP = _gbnf_literal(', "vigilant": ')
+REASON_OPEN = _gbnf_literal(', "reason": "')
+TARGET_SEP = _gbnf_literal(', "target_name": ')
+DECISION_CLOSE = _gbnf_literal('"}')
+SHARED_RULES = [
+    'vigilant ::= "100" | [1-9] [0-9] | [0-9]',
+    f'reason ::= word (" " word){{0,{REASON_WORDS - 1}}}',
+    f"word ::= [a-zA-Z]{{1,{REASON_WORD_LENGTH}}}",
+]
+
+
+def _decision_rules(
+    prefix: str, entities: List[str], resources: List[str], full_name=None
+) -> Tuple[List[str], int]:
+    """Rules for one decision object rooted at {prefix}decision, and its longest length."""
+    options = {"any": (ENTITY_ACTIONS + RESOURCE_ACTIONS, ["None"])}
+    if entities:
+        options["entity"] = (ENTITY_ACTIONS, entities)
+    if resources:
+        options["resource"] = (RESOURCE_ACTIONS, resources)
+
+    opening = "{"
+    if full_name is not None:
+        opening += f'"full_name": {json.dumps(full_name)}, '
+    opening += '"action": '
+
+    rules = [
+        f"{prefix}decision ::= {_gbnf_literal(opening)} {prefix}pair "
+        f"{VIGILANT_SEP} vigilant {REASON_OPEN} reason {DECISION_CLOSE}",
+        f"{prefix}pair ::= "
+        + " | ".join(f"{prefix}{name}-action {prefix}{name}-target" for name in options),
+    ]
+    for name, (actions, targets) in options.items():
+        rules.append(f"{prefix}{name}-action ::= ({_alternatives(actions)}) {TARGET_SEP}")
+        rules.append(f"{prefix}{name}-target ::= {_alternatives(targets)}")
+
+    longest_pair = max(
+        len(json.dumps(action)) + len(json.dumps(target))
+        for actions, targets in options.values()
+        for action in actions
+        for target in targets
+    )
+    fixed = len(opening) + len(', "target_name": , "vigilant": 100, "reason": ""}')
+    reason = REASON_WORDS * (REASON_WORD_LENGTH + 1) - 1
+    return rules, fixed + longest_pair + reason
+
+
+def decision_grammar(entities: List[str], resources: List[str]) -> Tuple[str, int]:
+    """GBNF grammar for one decision object, and its longest output in characters.
+
+    Actions are tied to their valid targets, vigilant is 0-100 and the
+    reason is at most REASON_WORDS short words, so every completion parses
+    and none can run on. Tokens never outnumber characters, which makes
+    the length a safe max_tokens.
+    """
+    rules, longest = _decision_rules("", entities, resources)
+    return "\n".join(["root ::= decision", *rules, *SHARED_RULES]) + "\n", longest
+
+
+def batch_decision_grammar(
+    npcs: List[Tuple[str, List[str], List[str]]],
+) -> Tuple[str, int]:
+    """Grammar for a JSON array with one decision per (full_name, entities, resources)."""
+    rules, roots = [], []
+    longest = len("[]")
+    for i, (full_name, entities, resources) in enumerate(npcs):
+        npc_rules, npc_longest = _decision_rules(f"npc{i}-", entities, resources, full_name)
+        rules.extend(npc_rules)
+        roots.append(f"npc{i}-decision")
+        longest += npc_longest + len(", ")
+    root = 'root ::= "[" ' + ' ", " '.join(roots) + ' "]"'
+    return "\n".join([root, *rules, *SHARED_RULES]) + "\n", longest
+
+
+def valid_decision(decision, entities: List[str], resources: List[str]) -> bool:
+    """Whether a parsed decision only uses actions and targets allowed to this NPC."""
+    if not isinstance(decision, dict):
+        return False
+    action, target = decision.get("action"), decision.get("target_name")
+    if action in ENTITY_ACTIONS:
+        allowed = entities
+    elif action in RESOURCE_ACTIONS:
+        allowed = resources
+    else:
+        return False
+    if target != "None" and target not in allowed:
+        return False
+    try:
+        return 0 <= int(decision.get("vigilant", 0)) <= 100
+    except (TypeError, ValueError):
+        return False
+
+
+# a field counts once its value is complete: a closed string or a number
+# followed by a separator
+DECISION_FIELD = re.compile(
+    r'"(action|target_name|vigilant|reason)"\s*:\s*'
+    r'("(?:[^"\\]|\\.)*"|-?\d+(?:\.\d+)?(?=\s*[,}]))'
+)
+
+
+class DecisionStream:
+    """Incremental parser for a streamed "Next step" decision.
+
+    feed() takes chunks as they arrive. Completed fields show up in fields
+    straight away; feed() returns True once the innermost JSON object
+    holding "action" closes, so the caller can stop generation there.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.fields = {}
+        self.decision = None
+        self.starts = []
+        self.in_string = False
+        self.escape = False
+
+    def feed(self, chunk: str) -> bool:
+        start = len(self.text)
+        self.text += chunk
+        for i in range(start, len(self.text)):
+            ch = self.text[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch == "{":
+                self.starts.append(i)
+            elif ch == "}" and self.starts:
+                begin = self.starts.pop()
+                try:
+                    data = json.loads(self.text[begin : i + 1])
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(data, dict) and "action" in data:
+                    self.decision = data
+                    self.fields.update(data)
+                    return True
+
+        for match in DECISION_FIELD.finditer(self.text):
+            self.fields[match.group(1)] = json.loads(match.group(2))
+        return False
+
+
+class DecisionBatcher:
+    """Answers the decisions of up to size NPCs with one prompt.
+
+    Requests arriving within wait seconds of each other share a prompt whose
+    grammar yields a JSON array with one decision per NPC, keyed by
+    full_name. Each decision is checked against that NPC's allowed actions
+    and targets before it is handed back; a missing or invalid one is raised
+    to its caller, which then asks on its own.
+    """
+
+    def __init__(
+        self,
+        api,
+        size: int = DECISION_BATCH_SIZE,
+        wait: float = DECISION_BATCH_WAIT,
+    ):
+        self.api = api
+        self.size = size
+        self.wait = wait
+        self.pending: List[Tuple[Dict, asyncio.Future]] = []
+        self.timer = None
+        self.calls = 0
+        self.decisions = 0
+
+    async def decide(self, request: Dict) -> Dict:
+        """request holds full_name, entities, resources and the NPC's context text."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((request, future))
+        if len(self.pending) >= self.size:
+            self._flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    def render(self, requests: List[Dict]) -> str:
+        contexts = "\n".join(request["context"] for request in requests)
+        return f"""
+            Next step explain, for each NPC below:
+
+            "full_name": The NPC's name
+            "action": Chose one from ("attack", "runaway", "heal") target entity or ("mine") target resource. You cant heal yourself.
+            "target_name": Your target name
+            "vigilant": A score from 0 to 100 indicating your current vigilant level.
+            "reason": less than 5 words.
+
+            Respond with a JSON array holding one object per NPC, in the order given, with the format [{{"full_name": string,"action": string,"target_name": string,"vigilant": int,"reason": reason}}]
+
+            NPCs:
+            {contexts}
+
+            'Next steps':
+            """
+
+    async def _run(self, batch):
+        requests = [request for request, _ in batch]
+        grammar, max_tokens = batch_decision_grammar(
+            [(r["full_name"], r["entities"], r["resources"]) for r in requests]
+        )
+        self.calls += 1
+        try:
+            response = await self.api.get_response(
+                user_input=self.render(requests),
+                grammar=grammar,
+                max_tokens=max_tokens,
+            )
+            array = json.loads(response[response.index("[") : response.rindex("]") + 1])
+            decisions = {d.get("full_name"): d for d in array if isinstance(d, dict)}
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for request, future in batch:
+            if future.done():
+                continue
+            decision = decisions.get(request["full_name"])
+            if valid_decision(decision, request["entities"], request["resources"]):
+                self.decisions += 1
+                future.set_result(decision)
+            else:
+                future.set_exception(
+                    ValueError(f"No valid decision for {request['full_name']}")
+                )
+
+
+_shared_batchers: Dict[str, DecisionBatcher] = {}
+
+
+def get_decision_batcher(model="gpt") -> DecisionBatcher:
+    if model not in _shared_batchers:
+        _shared_batchers[model] = DecisionBatcher(get_api(model))
+    return _shared_batchers[model]
+
+
 class Persona:
-    def __init__(self, model="gpt"):
-        if model == "gpt":
-            self.api = OpenaiAPI()
-        elif model == "local":
-            self.api = LocalAPI()
+    def __init__(self, model="gpt", memory=None):
+        self.api = get_api(model)
+        self.budget = PromptBudget(self.api.count_tokens)
+        # decide together with nearby NPCs in one prompt
+        self.batcher = get_decision_batcher(model) if DECISION_BATCH_SIZE > 1 else None
 
-        self.memory = MemoryStream()
+        self.memory = memory if memory is not None else get_memory_stream()
+        # everything this NPC has seen, beyond the last MEMORY_SIZE records
+        self.recall = MemoryIndex()
 
         self.decision = None
+        # completed decisions, partial ones not counted
+        self.decisions = 0
+        # fields of the decision still being generated
+        self.partial_decision = {}
         self.summary = None
 
         # actions
 
+    def get_targets(self, last_observation):
+        entities = [entity["entity_name"] for entity in last_observation["nearby_entities"]]
+        objects = [object["object_name"] for object in last_observation["nearby_objects"]]
+        return entities, objects
+
     def get_actions(self, last_observation):
-        entities = last_observation["nearby_entities"]
-        objects = last_observation["nearby_objects"]
+        entities, objects = self.get_targets(last_observation)
 
         target_entities = None
         target_resources = None
 
         if entities:
-            target_entities = ",".join([entity["entity_name"] for entity in entities])
+            target_entities = ",".join(entities)
 
         if objects:
-            target_resources = ",".join([object["object_name"] for object in objects])
+            target_resources = ",".join(objects)
 
         return target_entities, target_resources
 
-    def get_observations(self, observations):
-        result = [
+    def remember(self, memory_entry):
+        self.recall.add(memory_entry)
+
+    def get_recalled(self, stream_data, k=RETRIEVAL_K):
+        """Older observations most relevant to the latest one."""
+        recalled = self.recall.search(
+            observation_text(stream_data[-1]), k, exclude=stream_data
+        )
+        return self.observation_records(recalled)
+
+    def observation_records(self, observations):
+        # no timestamps: the same events seen again give the same prompt,
+        # which the backend response cache can answer
+        return [
             {
-                "timestamp": entry["timestamp"],
                 "observations": entry["self"].get("observations"),
+                "changes": entry.get("changes"),
             }
             for entry in observations
         ]
 
-        return json.dumps(result)
+    def get_observations(self, observations):
+        return json.dumps(self.observation_records(observations))
 
-    def get_progress(self, observations):
-        result = [
+    def progress_records(self, observations):
+        return [
             {
                 "timestamp": entry["timestamp"],
                 "observations": entry["self"].get("observations"),
@@ -59,7 +360,8 @@ class Persona:
             for entry in observations
         ]
 
-        return json.dumps(result)
+    def get_progress(self, observations):
+        return json.dumps(self.progress_records(observations))
 
     async def fetch_decision(
         self,
@@ -73,54 +375,139 @@ class Persona:
         stream_file = f"stream_{entity.full_name}.json"
         stream_data = self.memory.read_last_n_records(stream_file)
 
-        observations = self.get_observations(stream_data)
+        if self.batcher is not None:
+            request = self.decision_request(entity, stream_data, summary)
+            try:
+                self.decision = await self.batcher.decide(request)
+                self.decisions += 1
+                self.partial_decision = dict(self.decision)
+                print(f"{entity.full_name} decision: {json.dumps(self.decision)} \n")
+                return
+            except Exception as e:
+                print(f"Batched decision failed for {entity.full_name}: {e}")
+
         target_entities, target_resources = self.get_actions(stream_data[-1])
+        grammar, max_tokens = decision_grammar(*self.get_targets(stream_data[-1]))
+
+        # static instructions first, so the backend can reuse the evaluated
+        # prefix; everything that changes between calls goes last
+        def render(summary="", recalled="", observations=""):
+            return f"""
+            Next step explain:
+
+            "action": Chose one from ("attack", "runaway", "heal") target entity or ("mine") target resource. You cant heal yourself.
+            "target_name": Your target name
+            "vigilant": A score from 0 to 100 indicating your current vigilant level.
+            "reason": less than 5 words.
+
+            Respond in single JSON with the format of "Next step":{{"action": string,"target_name": string,"vigilant": int,"reason": reason}}
 
-        prompt = f"""
             Context:
             You are {entity.full_name}, and you are {entity.characteristic}.
-            
-            'progress summary': {summary}
-            'Observations':
-            {observations}
-            
-            
-            
+
             Can only interact with target entities:
             {target_entities}
             And can only mine target resources:
             {target_resources}
             Else target_name to "None" if no target.
-            
-            Next step explain:
 
-            "action": Chose one from ("attack", "runaway", "heal") target entity or ("mine") target resource. You cant heal yourself.
-            "target_name": Your target name
-            "vigilant": A score from 0 to 100 indicating your current vigilant level.
-            "reason": less than 5 words.
+            'progress summary': {summary}
+            'Relevant memories': {recalled}
+            'Observations':
+            {observations}
 
-            Respond in single JSON with the format of "Next step":{{"action": string,"target_name": string,"vigilant": int,"reason": reason}}
             'Next step':
             """
-        try:
-            response = await self.api.get_response(user_input=prompt)
-            try:
-                print(f"{entity.full_name} prompt: {prompt}\n")
-
-                response = "{" + response.split("{")[-1].split("}")[0] + "}"
-                print(f"{entity.full_name} decision: {response} \n")
 
-                data = json.loads(response)
-                self.decision = data
-
-                return
-            except json.JSONDecodeError:
-                print("Error load json")
+        # newest observations matter most, then the summary, then recall
+        packed = self.budget.pack(
+            render(),
+            [
+                ("observations", self.observation_records(stream_data)),
+                ("summary", summary or []),
+                ("recalled", self.get_recalled(stream_data)),
+            ],
+            budget=min(self.budget.budget, CONTEXT_LENGTH - max_tokens),
+        )
+        prompt = render(**packed)
+        print(f"{entity.full_name} prompt: {prompt}\n")
+        parser = DecisionStream()
+        self.partial_decision = {}
+        try:
+            stream = self.api.stream_response(
+                user_input=prompt, grammar=grammar, max_tokens=max_tokens
+            )
+            async with aclosing(stream):
+                async for chunk in stream:
+                    done = parser.feed(chunk)
+                    if done:
+                        break
+                    if parser.fields != self.partial_decision:
+                        self.partial_decision = dict(parser.fields)
+                        # enough to start moving before the reason is written
+                        if "action" in parser.fields and "target_name" in parser.fields:
+                            self.decision = self.partial_decision
 
         except Exception as e:
             print(f"Error getting decision: {e}")
             # Keep the current direction on error
 
+        if parser.decision is not None:
+            self.decision = parser.decision
+        elif "action" in parser.fields:
+            self.decision = dict(parser.fields)
+        else:
+            print(f"Error load json: {parser.text}")
+            return
+        self.decisions += 1
+        self.partial_decision = dict(self.decision)
+        print(f"{entity.full_name} decision: {json.dumps(self.decision)} \n")
+
+    def decision_request(self, entity: "Enemy", stream_data, summary) -> Dict:
+        """This NPC's part of a batched decision prompt, packed into its share of the budget."""
+        entities, resources = self.get_targets(stream_data[-1])
+
+        def render(summary="", recalled="", observations=""):
+            return f"""
+            NPC {entity.full_name}, who is {entity.characteristic}.
+            Can only interact with target entities: {",".join(entities) or None}
+            And can only mine target resources: {",".join(resources) or None}
+            'progress summary': {summary}
+            'Relevant memories': {recalled}
+            'Observations': {observations}
+            """
+
+        packed = self.budget.pack(
+            render(),
+            [
+                ("observations", self.observation_records(stream_data)),
+                ("summary", summary or []),
+                ("recalled", self.get_recalled(stream_data)),
+            ],
+            budget=self.batch_share(entity.full_name, entities, resources),
+        )
+        return {
+            "full_name": entity.full_name,
+            "entities": entities,
+            "resources": resources,
+            "context": render(**packed),
+        }
+
+    def batch_share(self, full_name, entities, resources) -> int:
+        """Tokens this NPC's context may use in a full batch prompt.
+
+        The shared instructions come off the top, then every NPC gets an
+        equal slice of what is left and pays for its own longest answer out
+        of it, so a full batch, answers included, fits CONTEXT_LENGTH.
+        """
+        size = self.batcher.size
+        header = self.budget.count_tokens(self.batcher.render([]))
+        _, answer = batch_decision_grammar([(full_name, entities, resources)])
+        return min(
+            (self.budget.budget - header) // size,
+            (CONTEXT_LENGTH - header) // size - answer,
+        )
+
     async def summary_context(
         self,
         entity: "Enemy",
@@ -129,7 +516,6 @@ class Persona:
         # memory_stream = self.memory.read_memory(entity)
         stream_file = f"stream_{entity.full_name}.json"
         stream_data = self.memory.read_last_n_records(stream_file)
-        progress = self.get_progress(stream_data)
 
         summary_file = f"summary_{entity.full_name}.json"
         summary = self.memory.read_last_n_records(summary_file, 1)
@@ -137,14 +523,25 @@ class Persona:
         # memory_stream = self.memory.read_last_n_records(memory_file, 2)
         # memory_stream = self.memory.read_last_n_records(memory_file, OBSERVATION_TO_SUMMARY)
 
-        prompt = f"""
+        def render(progress="", summary=""):
+            return f"""
+            Summarize your thought in plan text in short paragraph less than {threshold} words.
+
             Context:
             'history':{progress}
             'last summary': {summary}
-            
-            Summarize your thought in plan text in short paragraph less than {threshold} words.
+
             'Your thought': """
 
+        packed = self.budget.pack(
+            render(),
+            [
+                ("progress", self.progress_records(stream_data or [])),
+                ("summary", summary or []),
+            ],
+        )
+        prompt = render(**packed)
+
         print(prompt)
         try:
             # print(f"prompt: {prompt}\n")
@@ -155,7 +552,7 @@ class Persona:
             self.summary = response
 
             filename = f"summary_{entity.full_name}.json"
-            self.save_summary(response, filename, threshold=MEMORY_SIZE)
+            self.save_summary(response, filename, threshold=SUMMARY_SIZE)
 
             return
 
@@ -163,7 +560,7 @@ class Persona:
             print(f"Error getting summary: {e}")
             # Keep the current direction on error
 
-    def save_summary(self, entry, filename, threshold=MEMORY_SIZE):
+    def save_summary(self, entry, filename, threshold=SUMMARY_SIZE):
         timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
 
         entry = {"timestamp": timestamp, "summary": entry}
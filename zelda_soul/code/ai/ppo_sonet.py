@@ -1,37 +1,94 @@
 import gymnasium as gym
 import numpy as np
+import queue
+import threading
+from concurrent.futures import Future
 import torch
 import torch.nn as nn
 import torch.optim as optim
 from torch.distributions import Categorical
 from environment.env import Environment, EnvironmentConfig
+from utils.metrics import Metrics
+from ai.checkpoint import CheckpointWriter
 import torch.nn as nn
 
 
-class PPOMemory:
-    def __init__(self):
-        self.states = []
-        self.actions = []
-        self.rewards = []
-        self.probs = []
-        self.values = []
-        self.dones = []
+def encode_state(obs, input_dim, n_types=4):
+    """Turn the flat one-hot grid of an observation back into type codes."""
+    grid = obs["onehot"][: input_dim * input_dim * n_types]
+    return grid.reshape(input_dim, input_dim, n_types).argmax(axis=-1)
+
+
+class RolloutBuffer:
+    def __init__(self, capacity, state_shape, n_envs=1, gamma=0.99, gae_lambda=0.95):
+        self.capacity = capacity
+        self.n_envs = n_envs
+        self.gamma = gamma
+        self.gae_lambda = gae_lambda
+
+        self.states = torch.zeros((capacity, n_envs, *state_shape), dtype=torch.long)
+        self.actions = torch.zeros((capacity, n_envs), dtype=torch.long)
+        self.rewards = torch.zeros((capacity, n_envs))
+        self.log_probs = torch.zeros((capacity, n_envs))
+        self.values = torch.zeros((capacity, n_envs))
+        self.dones = torch.zeros((capacity, n_envs))
+        self.advantages = torch.zeros((capacity, n_envs))
+        self.returns = torch.zeros((capacity, n_envs))
+        self.ptr = 0
+
+    @property
+    def full(self):
+        return self.ptr >= self.capacity
 
     def clear(self):
-        self.states = []
-        self.actions = []
-        self.rewards = []
-        self.probs = []
-        self.values = []
-        self.dones = []
-
-    def store(self, state, action, reward, prob, value, done):
-        self.states.append(state)
-        self.actions.append(action)
-        self.rewards.append(reward)
-        self.probs.append(prob)
-        self.values.append(value)
-        self.dones.append(done)
+        self.ptr = 0
+
+    def store(self, state, action, reward, log_prob, value, done):
+        """Store one step; every argument is a scalar or one value per env."""
+        i = self.ptr
+        self.states[i] = torch.as_tensor(np.asarray(state))
+        self.actions[i] = torch.as_tensor(action)
+        self.rewards[i] = torch.as_tensor(reward, dtype=torch.float32)
+        self.log_probs[i] = torch.as_tensor(log_prob, dtype=torch.float32)
+        self.values[i] = torch.as_tensor(value, dtype=torch.float32)
+        self.dones[i] = torch.as_tensor(done, dtype=torch.float32)
+        self.ptr += 1
+
+    def compute_advantages(self, last_value=0.0):
+        """GAE(lambda) over the stored steps, bootstrapped from last_value."""
+        n = self.ptr
+        values = self.values[:n]
+        not_done = 1.0 - self.dones[:n]
+        last_value = torch.as_tensor(last_value, dtype=torch.float32)
+        next_values = torch.cat((values[1:], last_value.expand(1, self.n_envs)))
+
+        deltas = self.rewards[:n] + self.gamma * next_values * not_done - values
+        discounts = self.gamma * self.gae_lambda * not_done
+
+        # single reversed pass over the precomputed deltas, all envs at once
+        gae = torch.zeros(self.n_envs)
+        for t in range(n - 1, -1, -1):
+            gae = deltas[t] + discounts[t] * gae
+            self.advantages[t] = gae
+
+        self.returns[:n] = self.advantages[:n] + values
+
+    def flattened(self):
+        """Stored steps of every env as one (n * n_envs) batch."""
+        n = self.ptr
+        return (
+            self.states[:n].flatten(0, 1),
+            self.actions[:n].flatten(),
+            self.log_probs[:n].flatten(),
+            self.returns[:n].flatten(),
+            self.advantages[:n].flatten(),
+        )
+
+    def minibatches(self, batch_size):
+        size = self.ptr * self.n_envs
+        indices = torch.randperm(size)
+        for start in range(0, size, batch_size):
+            yield indices[start : start + batch_size]
 
 
 class ActorCritic(nn.Module):
@@ -91,6 +148,102 @@ class ActorCritic(nn.Module):
         return action_probs, value
 
 
+class InferenceServer:
+    """Evaluates the policy for many environments in one forward pass.
+
+    act() serves a batch the caller already has; start()/submit() run a
+    worker thread that gathers single states from independent producers
+    into batches of up to max_batch_size, waiting at most max_wait seconds.
+    """
+
+    def __init__(
+        self,
+        model,
+        n_threads=None,
+        use_compile=False,
+        max_batch_size=64,
+        max_wait=0.002,
+    ):
+        self.model = model
+        self.n_threads = n_threads
+        self.policy = model
+        if use_compile and hasattr(torch, "compile"):
+            self.policy = torch.compile(model, dynamic=True)
+
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.worker = None
+        self.running = False
+
+    def act(self, states):
+        set_num_threads(self.n_threads)
+        states = torch.as_tensor(np.asarray(states), dtype=torch.long)
+        with torch.inference_mode():
+            action_probs, values = self.policy(states)
+            dist = Categorical(action_probs)
+            actions = dist.sample()
+            log_probs = dist.log_prob(actions)
+
+        return actions.numpy(), log_probs.numpy(), values.squeeze(-1).numpy()
+
+    def evaluate(self, states):
+        set_num_threads(self.n_threads)
+        states = torch.as_tensor(np.asarray(states), dtype=torch.long)
+        with torch.inference_mode():
+            _, values = self.policy(states)
+        return values.squeeze(-1).numpy()
+
+    def submit(self, state):
+        future = Future()
+        self.requests.put((state, future))
+        return future
+
+    def start(self):
+        if self.worker is None:
+            self.running = True
+            self.worker = threading.Thread(target=self._serve, daemon=True)
+            self.worker.start()
+
+    def stop(self):
+        if self.worker is not None:
+            self.running = False
+            self.requests.put(None)
+            self.worker.join()
+            self.worker = None
+
+    def _serve(self):
+        while self.running:
+            request = self.requests.get()
+            if request is None:
+                break
+            batch = [request]
+            try:
+                while len(batch) < self.max_batch_size:
+                    request = self.requests.get(timeout=self.max_wait)
+                    if request is None:
+                        self.running = False
+                        break
+                    batch.append(request)
+            except queue.Empty:
+                pass
+
+            states, futures = zip(*batch)
+            try:
+                actions, log_probs, values = self.act(np.stack(states))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for i, future in enumerate(futures):
+                future.set_result((int(actions[i]), float(log_probs[i]), float(values[i])))
+
+
+def set_num_threads(n_threads):
+    if n_threads and torch.get_num_threads() != n_threads:
+        torch.set_num_threads(n_threads)
+
+
 class PPOAgent:
     def __init__(
         self,
@@ -98,131 +251,219 @@ class PPOAgent:
         n_actions,
         lr=0.0001,
         gamma=0.99,
+        gae_lambda=0.95,
         clip_epsilon=0.15,
         n_epochs=10,
-        batch_size=32,
+        batch_size=64,
+        n_steps=2048,
+        n_envs=1,
+        n_threads=None,
     ):
         self.gamma = gamma
         self.clip_epsilon = clip_epsilon
         self.n_epochs = n_epochs
         self.batch_size = batch_size
+        # torch's thread count is global and inference may lower it, so
+        # learn() restores this one (the count at construction by default)
+        self.n_threads = n_threads or torch.get_num_threads()
 
         self.actor_critic = ActorCritic(input_dim, n_actions)
         self.optimizer = optim.Adam(self.actor_critic.parameters(), lr=lr)
-        self.memory = PPOMemory()
+        self.memory = RolloutBuffer(
+            n_steps,
+            (input_dim, input_dim),
+            n_envs=n_envs,
+            gamma=gamma,
+            gae_lambda=gae_lambda,
+        )
 
     def choose_action(self, state):
-        state = torch.LongTensor(state).unsqueeze(0)
+        state = torch.as_tensor(state, dtype=torch.long).unsqueeze(0)
 
-        with torch.no_grad():
+        with torch.inference_mode():
             action_probs, value = self.actor_critic(state)
 
         dist = Categorical(action_probs)
         action = dist.sample()
 
-        return action.item(), action_probs[0][action.item()].item(), value.item()
+        return action.item(), dist.log_prob(action).item(), value.item()
 
-    def learn(self):
-        states = torch.LongTensor(np.array(self.memory.states))
-        actions = torch.LongTensor(np.array(self.memory.actions))
-        old_probs = torch.FloatTensor(np.array(self.memory.probs))
-        values = torch.FloatTensor(np.array(self.memory.values))
+    def evaluate(self, state):
+        state = torch.as_tensor(state, dtype=torch.long).unsqueeze(0)
+        with torch.inference_mode():
+            _, value = self.actor_critic(state)
+        return value.item()
 
-        # Calculate advantages
-        rewards = []
-        discounted_reward = 0
-        for reward, done in zip(
-            reversed(self.memory.rewards), reversed(self.memory.dones)
-        ):
-            if done:
-                discounted_reward = 0
-            discounted_reward = reward + (self.gamma * discounted_reward)
-            rewards.insert(0, discounted_reward)
-
-        rewards = torch.FloatTensor(rewards)
-        rewards = (rewards - rewards.mean()) / (rewards.std() + 1e-8)
-        advantages = rewards - values
+    def learn(self, last_value=0.0):
+        set_num_threads(self.n_threads)
+        self.memory.compute_advantages(last_value)
+        states, actions, old_log_probs, returns, advantages = self.memory.flattened()
 
-        # Update policy
+        # Update policy on shuffled minibatches
         for _ in range(self.n_epochs):
-            action_probs, critic_value = self.actor_critic(states)
-            dist = Categorical(action_probs)
-            new_probs = dist.log_prob(actions)
-
-            # Policy loss
-            ratio = torch.exp(new_probs - torch.log(old_probs))
-            surr1 = ratio * advantages
-            surr2 = (
-                torch.clamp(ratio, 1 - self.clip_epsilon, 1 + self.clip_epsilon)
-                * advantages
-            )
-            actor_loss = -torch.min(surr1, surr2).mean()
-
-            # Value loss
-            critic_loss = nn.MSELoss()(critic_value.squeeze(), rewards)
-
-            # entropy loss
-            entropy_loss = -0.01 * dist.entropy().mean()
-
-            # Total loss
-            total_loss = actor_loss + 0.5 * critic_loss + entropy_loss
-
-            # Update network
-            self.optimizer.zero_grad()
-            total_loss.backward()
-            self.optimizer.step()
+            for idx in self.memory.minibatches(self.batch_size):
+                batch_advantages = advantages[idx]
+                if len(idx) > 1:
+                    batch_advantages = (batch_advantages - batch_advantages.mean()) / (
+                        batch_advantages.std() + 1e-8
+                    )
+
+                action_probs, critic_value = self.actor_critic(states[idx])
+                dist = Categorical(action_probs)
+                new_log_probs = dist.log_prob(actions[idx])
+
+                # Policy loss
+                ratio = torch.exp(new_log_probs - old_log_probs[idx])
+                surr1 = ratio * batch_advantages
+                surr2 = (
+                    torch.clamp(ratio, 1 - self.clip_epsilon, 1 + self.clip_epsilon)
+                    * batch_advantages
+                )
+                actor_loss = -torch.min(surr1, surr2).mean()
+
+                # Value loss
+                critic_loss = nn.MSELoss()(critic_value.squeeze(-1), returns[idx])
+
+                # entropy loss
+                entropy_loss = -0.01 * dist.entropy().mean()
+
+                # Total loss
+                total_loss = actor_loss + 0.5 * critic_loss + entropy_loss
+
+                # Update network
+                self.optimizer.zero_grad()
+                total_loss.backward()
+                self.optimizer.step()
 
         self.memory.clear()
 
 
-def train():
+def train(
+    n_envs=8,
+    seed=None,
+    inference_threads=1,
+    learn_threads=None,
+    metrics_path=None,
+    metrics_backend="csv",
+    checkpoint_dir="checkpoints",
+    checkpoint_every=10,
+    resume=False,
+):
     # env = gym.make('CartPole-v1', render_mode=None)
-    config = EnvironmentConfig()
-    env = Environment(config)
-    input_dim = len(env.observation())
-    n_actions = len(env.int_to_action)
-
-    agent = PPOAgent(input_dim=input_dim, n_actions=n_actions)
+    metrics = Metrics(
+        enabled=metrics_path is not None, path=metrics_path, backend=metrics_backend
+    )
+    seeds = np.random.SeedSequence(seed).spawn(n_envs)
+    configs = [EnvironmentConfig(seed=s) for s in seeds]
+    envs = [Environment(config) for config in configs]
+    for env in envs:
+        env.metrics = metrics
+    input_dim = configs[0].observation_window or configs[0].size
+    n_actions = len(envs[0].int_to_action)
+    n_types = envs[0].n_types
+
+    agent = PPOAgent(
+        input_dim=input_dim,
+        n_actions=n_actions,
+        n_steps=2048 // n_envs,
+        n_envs=n_envs,
+        n_threads=learn_threads,
+    )
+    server = InferenceServer(agent.actor_critic, n_threads=inference_threads)
     n_episodes = 100000
     max_steps = 500
     best_reward = float("-inf")
 
-    for episode in range(n_episodes):
-        state, _ = env.reset()
-        episode_reward = 0
-
-        for step in range(max_steps):
-            action, prob, value = agent.choose_action(state)
-            next_state, reward, terminated, truncated, _ = env.step(action)
-            done = terminated or truncated
-
-            # debug
-            # env.render()
-            # print(env.int_to_action[action]," ", reward)
-            # print(env.player.stats)
-
-            state = next_state
-            episode_reward += reward
-            agent.memory.store(state, action, reward, prob, value, done)
+    states = np.stack([encode_state(env.reset()[0], input_dim, n_types) for env in envs])
+    episode_rewards = np.zeros(n_envs)
+    episode_steps = np.zeros(n_envs, dtype=int)
+    episode = 0
+    total_steps = 0
+
+    # checkpoints are taken after learn(), when the rollout buffer is empty
+    checkpoints = CheckpointWriter(checkpoint_dir, every=checkpoint_every)
+    if resume:
+        checkpoint = checkpoints.load_latest(agent.actor_critic, agent.optimizer)
+        if checkpoint:
+            extra = checkpoint["extra"]
+            for env, snapshot in zip(envs, extra["envs"]):
+                env.restore(snapshot)
+            states = np.stack(
+                [encode_state(env.observation(), input_dim, n_types) for env in envs]
+            )
+            episode_rewards = extra["episode_rewards"]
+            episode_steps = extra["episode_steps"]
+            episode = extra["episode"]
+            best_reward = extra["best_reward"]
+            total_steps = checkpoint["step"]
+
+    while episode < n_episodes:
+        # one batched forward pass for every environment
+        with metrics.timer("policy_inference"):
+            actions, log_probs, values = server.act(states)
+        rewards = np.zeros(n_envs)
+        dones = np.zeros(n_envs, dtype=bool)
+        next_states = np.empty_like(states)
+
+        for i, env in enumerate(envs):
+            with metrics.timer("env_step"):
+                next_obs, reward, terminated, truncated, _ = env.step(int(actions[i]))
+            episode_steps[i] += 1
+            done = terminated or truncated or episode_steps[i] >= max_steps
+            rewards[i] = reward
+            dones[i] = done
+            episode_rewards[i] += reward
 
             if done:
-                break
-
-        agent.learn()
-
-        if episode % 20 == 0:
-            print(f"Episode {episode}, Reward: {episode_reward}")
-
-            if episode_reward > best_reward:
-                best_reward = episode_reward
-                torch.save(agent.actor_critic.state_dict(), "best_model.pth")
-                print(f"Best model saved. Episode: {episode}, Reward: {episode_reward}")
+                episode_reward = episode_rewards[i]
+                metrics.record("episode_reward", episode_reward)
+                metrics.record("episode_length", episode_steps[i])
+                if episode % 20 == 0:
+                    print(f"Episode {episode}, Reward: {episode_reward}")
+
+                    if episode_reward > best_reward:
+                        best_reward = episode_reward
+                        checkpoints.export("best_model.pth", agent.actor_critic)
+                        print(
+                            f"Best model saved. Episode: {episode}, Reward: {episode_reward}"
+                        )
+                episode += 1
+                episode_rewards[i] = 0
+                episode_steps[i] = 0
+                next_obs, _ = env.reset()
+
+            next_states[i] = encode_state(next_obs, input_dim, n_types)
+
+        agent.memory.store(states, actions, rewards, log_probs, values, dones)
+        states = next_states
+        total_steps += n_envs
+
+        if agent.memory.full:
+            with metrics.timer("learn"):
+                agent.learn(last_value=server.evaluate(states))
+            metrics.log(total_steps)
+            checkpoints.maybe_save(
+                total_steps,
+                agent.actor_critic,
+                agent.optimizer,
+                extra={
+                    "envs": [env.snapshot() for env in envs],
+                    "episode_rewards": episode_rewards.copy(),
+                    "episode_steps": episode_steps.copy(),
+                    "episode": episode,
+                    "best_reward": best_reward,
+                },
+            )
 
+    checkpoints.close()
+    metrics.close()
     return agent
 
 
 def run(agent):
-    env = Environment()
+    config = EnvironmentConfig()
+    env = Environment(config)
+    input_dim = config.observation_window or config.size
     obs = env.reset()
     done = False
 
@@ -231,7 +472,8 @@ def run(agent):
         obs, info = env.reset()
         done = False
         while not done:
-            action, prob, value = agent.choose_action(obs)
+            state = encode_state(obs, input_dim, env.n_types)
+            action, log_prob, value = agent.choose_action(state)
             obs, reward, terminated, truncated, _ = env.step(action)
             done = terminated or truncated
             env.render()
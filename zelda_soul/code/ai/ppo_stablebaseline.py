@@ -1,10 +1,78 @@
 from stable_baselines3 import PPO
 from stable_baselines3.common.env_util import make_vec_env
 from stable_baselines3.common.env_checker import check_env
+from stable_baselines3.common.callbacks import BaseCallback
+import time
 from environment.env import Environment, EnvironmentConfig
+from utils.metrics import Metrics
+from ai.checkpoint import CheckpointWriter
 
 
-def train(model=None, total_timesteps=1000000):
+class MetricsCallback(BaseCallback):
+    """Feeds rollout/learn timings and episode rewards into a Metrics log."""
+
+    def __init__(self, metrics: Metrics, verbose=0):
+        super().__init__(verbose)
+        self.metrics = metrics
+        self.phase_start = None
+
+    def _on_rollout_start(self) -> None:
+        now = time.perf_counter()
+        if self.phase_start is not None:
+            # time since the last rollout ended is the gradient update
+            self.metrics.record("learn", now - self.phase_start)
+            self.metrics.log(self.num_timesteps)
+        self.phase_start = now
+
+    def _on_step(self) -> bool:
+        self.metrics.count("env_steps", self.training_env.num_envs)
+        for info in self.locals.get("infos", []):
+            episode = info.get("episode")
+            if episode:
+                self.metrics.record("episode_reward", episode["r"])
+                self.metrics.record("episode_length", episode["l"])
+        return True
+
+    def _on_rollout_end(self) -> None:
+        now = time.perf_counter()
+        self.metrics.record("rollout", now - self.phase_start)
+        self.phase_start = now
+
+    def _on_training_end(self) -> None:
+        self.metrics.log(self.num_timesteps)
+        self.metrics.close()
+
+
+class CheckpointCallback(BaseCallback):
+    """Queues policy/optimiser checkpoints on a background writer every save_freq steps."""
+
+    def __init__(self, writer: CheckpointWriter, save_freq=50000, verbose=0):
+        super().__init__(verbose)
+        self.writer = writer
+        self.save_freq = save_freq
+        self.last_save = 0
+
+    def _on_step(self) -> bool:
+        if self.num_timesteps - self.last_save >= self.save_freq:
+            self.last_save = self.num_timesteps
+            self.writer.save(
+                self.num_timesteps, self.model.policy, self.model.policy.optimizer
+            )
+        return True
+
+    def _on_training_end(self) -> None:
+        self.writer.close()
+
+
+def train(
+    model=None,
+    total_timesteps=1000000,
+    metrics_path=None,
+    metrics_backend="csv",
+    checkpoint_dir="checkpoints",
+    save_freq=50000,
+    resume=False,
+):
     env = Environment()
     check_env(env, warn=True, skip_render_check=True)
     # Wrap the environment to be compatible with Stable-Baselines3
@@ -27,8 +95,25 @@ def train(model=None, total_timesteps=1000000):
     else:
         model.set_env(env)
 
+    writer = CheckpointWriter(checkpoint_dir, prefix="ppo")
+    reset_num_timesteps = True
+    if resume:
+        checkpoint = writer.load_latest(model.policy, model.policy.optimizer)
+        if checkpoint:
+            model.num_timesteps = checkpoint["step"]
+            reset_num_timesteps = False
+
     # Train the model
-    model.learn(total_timesteps=total_timesteps)
+    callbacks = [CheckpointCallback(writer, save_freq=save_freq)]
+    if metrics_path:
+        callbacks.append(
+            MetricsCallback(Metrics(path=metrics_path, backend=metrics_backend))
+        )
+    model.learn(
+        total_timesteps=total_timesteps,
+        callback=callbacks,
+        reset_num_timesteps=reset_num_timesteps,
+    )
 
     # Save the best model
     model.save("ppo_best_model")
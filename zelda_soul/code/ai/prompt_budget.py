@@ -0,0 +1,53 @@
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from settings import PROMPT_TOKEN_BUDGET
+
+
+class PromptBudget:
+    """Fits prompt sections into a token budget, most important first.
+
+    pack() takes the fixed text of the prompt and (name, value) sections in
+    priority order. A list section keeps as many of its newest items as
+    still fit; any other section is kept whole or left empty. Token counts
+    come from the backend's tokenizer.
+    """
+
+    def __init__(
+        self,
+        count_tokens: Callable[[str], int],
+        budget: int = PROMPT_TOKEN_BUDGET,
+    ):
+        self.count_tokens = count_tokens
+        self.budget = budget
+
+    def pack(
+        self,
+        fixed: str,
+        sections: List[Tuple[str, Any]],
+        budget: Optional[int] = None,
+    ) -> Dict[str, str]:
+        remaining = (budget or self.budget) - self.count_tokens(fixed)
+        packed = {}
+        for name, value in sections:
+            if isinstance(value, list):
+                kept = []
+                cost = self.count_tokens("[]")
+                for item in reversed(value):
+                    # +1 for the separator between items
+                    item_cost = self.count_tokens(json.dumps(item)) + 1
+                    if cost + item_cost > remaining:
+                        break
+                    kept.append(item)
+                    cost += item_cost
+                kept.reverse()
+                text = json.dumps(kept)
+            else:
+                text = value if isinstance(value, str) else json.dumps(value)
+                cost = self.count_tokens(text)
+                if cost > remaining:
+                    text, cost = "", 0
+
+            packed[name] = text
+            remaining -= cost
+        return packed
@@ -0,0 +1,167 @@
+import re
+import time
+import zlib
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from settings import (
+    EMBEDDING_MODEL,
+    EMBEDDING_DIM,
+    RETRIEVAL_CAPACITY,
+    RETRIEVAL_HALF_LIFE,
+)
+
+TOKEN = re.compile(r"[a-z0-9]+")
+
+# words in an observation that make it worth recalling later
+IMPORTANT_WORDS = {
+    "attack": 0.3,
+    "attacked": 0.3,
+    "damage": 0.3,
+    "died": 0.5,
+    "dead": 0.5,
+    "kill": 0.5,
+    "killed": 0.5,
+    "heal": 0.2,
+    "healed": 0.2,
+    "runaway": 0.2,
+    "energy": 0.1,
+}
+
+
+class HashingEmbedder:
+    """Signed feature hashing of words and word pairs; needs no model download."""
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = TOKEN.findall(text.lower())
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                h = zlib.crc32(feature.encode())
+                vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class SentenceEmbedder:
+    """Small local sentence-transformers model, e.g. all-MiniLM-L6-v2."""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(
+            texts, normalize_embeddings=True, convert_to_numpy=True
+        ).astype(np.float32)
+
+
+@lru_cache(maxsize=None)
+def get_embedder(model_name: Optional[str] = EMBEDDING_MODEL):
+    """Embedder shared by every persona; falls back to hashing without the model."""
+    if model_name:
+        try:
+            return SentenceEmbedder(model_name)
+        except Exception as e:
+            print(f"Using hashing embedder, could not load {model_name}: {e}")
+    return HashingEmbedder()
+
+
+def observation_text(entry: Dict[str, Any]) -> str:
+    """Flatten a memory stream entry into the text that gets embedded."""
+    parts = []
+    own = entry.get("self", {})
+    parts.extend(str(v) for v in (own.get("observations") or {}).values() if v)
+    for other in entry.get("nearby_entities", []):
+        parts.append(
+            f"{other.get('entity_name')} {other.get('action')} {other.get('target_name')}"
+        )
+    for obj in entry.get("nearby_objects", []):
+        parts.append(str(obj.get("object_name")))
+    return ". ".join(parts)
+
+
+def observation_importance(text: str) -> float:
+    words = set(TOKEN.findall(text.lower()))
+    return min(1.0, sum(IMPORTANT_WORDS.get(word, 0.0) for word in words))
+
+
+class MemoryIndex:
+    """Flat in-memory vector index over one NPC's observations.
+
+    Vectors are unit length, so relevance is a single matrix-vector dot
+    product. Each hit is scored as a weighted sum of relevance, recency
+    (halving every half_life seconds) and importance. When full, the oldest
+    memory is overwritten.
+    """
+
+    def __init__(
+        self,
+        embedder=None,
+        capacity: int = RETRIEVAL_CAPACITY,
+        half_life: float = RETRIEVAL_HALF_LIFE,
+        weights=(1.0, 0.5, 0.5),
+    ):
+        self.embedder = embedder if embedder is not None else get_embedder()
+        self.capacity = capacity
+        self.half_life = half_life
+        self.weights = weights
+
+        self.vectors = np.zeros((capacity, self.embedder.dim), dtype=np.float32)
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.importance = np.zeros(capacity, dtype=np.float32)
+        self.records: List[Optional[Dict[str, Any]]] = [None] * capacity
+        self.size = 0
+        self.next = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, record: Dict[str, Any], importance: Optional[float] = None) -> None:
+        text = observation_text(record)
+        i = self.next
+        self.vectors[i] = self.embedder.embed([text])[0]
+        self.times[i] = time.time()
+        self.importance[i] = (
+            observation_importance(text) if importance is None else importance
+        )
+        self.records[i] = record
+        self.next = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def search(
+        self, query: str, k: int, exclude: Optional[List[Dict[str, Any]]] = None
+    ) -> List[Dict[str, Any]]:
+        """Top-k records, best first, skipping any record in exclude."""
+        if not self.size:
+            return []
+        n = self.size
+        relevance = self.vectors[:n] @ self.embedder.embed([query])[0]
+        age = time.time() - self.times[:n]
+        recency = 0.5 ** (age / self.half_life)
+        w_relevance, w_recency, w_importance = self.weights
+        scores = (
+            w_relevance * relevance
+            + w_recency * recency
+            + w_importance * self.importance[:n]
+        )
+
+        skip = {id(record) for record in exclude or []}
+        m = min(k + len(skip), n)
+        top = np.argpartition(-scores, m - 1)[:m]
+        hits = []
+        for i in top[np.argsort(-scores[top])]:
+            record = self.records[i]
+            if id(record) in skip:
+                continue
+            hits.append(record)
+            if len(hits) == k:
+                break
+        return hits
@@ -0,0 +1,161 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from settings import (
+    LLM_MAX_IN_FLIGHT,
+    LLM_DEADLINE,
+    LLM_BATCH_SIZE,
+    LLM_BATCH_WAIT,
+)
+from utils.priorityqueue import PriorityQueueWithUpdate
+
+
+class LLMScheduler:
+    """Keeps up to max_in_flight queued LLM coroutines running at once.
+
+    Drop-in for the PriorityQueueWithUpdate the enemies already feed
+    (put/has/qsize/empty), so distance still decides who goes first. Each
+    task carries a deadline from the moment it is queued; tasks that expire
+    in the queue are dropped and running ones are cancelled when it passes.
+    Call pump() once per frame.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = LLM_MAX_IN_FLIGHT,
+        deadline: float = LLM_DEADLINE,
+    ):
+        self.max_in_flight = max_in_flight
+        self.deadline = deadline
+        self.queue = PriorityQueueWithUpdate()
+        self.deadlines: Dict[Any, float] = {}
+        self.in_flight: set = set()
+
+        self.completed = 0
+        self.expired = 0
+        self.failed = 0
+
+    def put(self, priority, task, deadline: Optional[float] = None):
+        """Queue or re-prioritise a task; deadline is seconds from first queueing."""
+        if task not in self.deadlines:
+            self.deadlines[task] = time.monotonic() + (deadline or self.deadline)
+        self.queue.put(priority, task)
+
+    def has(self, task) -> bool:
+        return self.queue.has(task)
+
+    def qsize(self) -> int:
+        return self.queue.qsize()
+
+    def empty(self) -> bool:
+        return self.queue.empty()
+
+    def running(self) -> int:
+        return len(self.in_flight)
+
+    def pump(self) -> None:
+        """Reap finished tasks and start queued ones up to the in-flight limit."""
+        for task in [t for t in self.in_flight if t.done()]:
+            self.in_flight.discard(task)
+            if task.cancelled():
+                self.failed += 1
+            elif isinstance(task.exception(), asyncio.TimeoutError):
+                self.expired += 1
+            elif task.exception() is not None:
+                print(f"Task failed: {task.exception()}")
+                self.failed += 1
+            else:
+                self.completed += 1
+
+        now = time.monotonic()
+        while len(self.in_flight) < self.max_in_flight and not self.queue.empty():
+            _, coro = self.queue.get()
+            remaining = self.deadlines.pop(coro) - now
+            if remaining <= 0:
+                # stale decision, never worth starting
+                coro.close()
+                self.expired += 1
+                continue
+            self.in_flight.add(
+                asyncio.create_task(asyncio.wait_for(coro, timeout=remaining))
+            )
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self.qsize(),
+            "in_flight": self.running(),
+            "completed": self.completed,
+            "expired": self.expired,
+            "failed": self.failed,
+        }
+
+
+class PromptBatcher:
+    """Coalesces concurrent get_response calls into backend batch calls.
+
+    Prompts sent with the same keyword arguments within batch_wait seconds
+    are merged into one get_responses() call of up to batch_size prompts.
+    Backends without get_responses are called directly, with no wait:
+    llama.cpp runs one completion at a time, so merging prompts for
+    LocalAPI would only hold its single slot longer.
+    """
+
+    def __init__(
+        self,
+        api,
+        batch_size: int = LLM_BATCH_SIZE,
+        batch_wait: float = LLM_BATCH_WAIT,
+    ):
+        self.api = api
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.pending: Dict[Tuple, List[Tuple[str, asyncio.Future]]] = {}
+        self.timers: Dict[Tuple, asyncio.TimerHandle] = {}
+        self.batches = 0
+        self.prompts = 0
+
+    def __getattr__(self, name):
+        return getattr(self.api, name)
+
+    async def get_response(self, user_input, **kwargs):
+        try:
+            key = tuple(sorted(kwargs.items()))
+            hash(key)
+        except TypeError:
+            key = None
+        if key is None or not hasattr(self.api, "get_responses"):
+            return await self.api.get_response(user_input, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self.pending.setdefault(key, [])
+        batch.append((user_input, future))
+        if len(batch) >= self.batch_size:
+            self._flush(key)
+        elif key not in self.timers:
+            self.timers[key] = loop.call_later(self.batch_wait, self._flush, key)
+        return await future
+
+    def _flush(self, key):
+        timer = self.timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        batch = self.pending.pop(key, [])
+        if batch:
+            asyncio.ensure_future(self._run(batch, dict(key)))
+
+    async def _run(self, batch, kwargs):
+        self.batches += 1
+        self.prompts += len(batch)
+        prompts = [prompt for prompt, _ in batch]
+        try:
+            responses = await self.api.get_responses(prompts, **kwargs)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), response in zip(batch, responses):
+            if not future.done():
+                future.set_result(response)
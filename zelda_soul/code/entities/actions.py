@@ -1,5 +1,5 @@
 from typing import TYPE_CHECKING, Tuple, List, Dict, Union, Optional, TypeAlias
-import random
+import numpy as np
 from environment.pathfinder import Pathfinder
 
 if TYPE_CHECKING:
@@ -11,8 +11,9 @@ Location: TypeAlias = Tuple[int, int]
 
 
 class Action:
-    def __init__(self) -> None:
+    def __init__(self, rng: Optional[np.random.Generator] = None) -> None:
         self.pathfinder = Pathfinder()
+        self.rng = rng if rng is not None else np.random.default_rng()
 
     def move(
         self, c: "Creature", target_location: Location, env: "Environment"
@@ -116,10 +117,12 @@ class Action:
         a_genome = a.genome
         b_genome = b.genome
         for key in a_genome.keys():
-            child_genome[key] = []
-            for i in range(len(a_genome[key])):
-                gene = a_genome[key][i] if random.random() < 0.5 else b_genome[key][i]
-                child_genome[key].append(gene)
+            # one draw per gene, taken from the crossover stream
+            from_a = self.rng.random(len(a_genome[key])) < 0.5
+            child_genome[key] = [
+                a_gene if pick else b_gene
+                for a_gene, b_gene, pick in zip(a_genome[key], b_genome[key], from_a)
+            ]
         return child_genome
 
     def receive_damage(self, c: "Creature", damage: int) -> bool:
@@ -1,4 +1,5 @@
 from typing import TYPE_CHECKING, Tuple, List, Dict, Union, Optional, TypeAlias
+import numpy as np
 from .stats import Stats, Genome, CreatureStat, Status
 from .actions import Action
 
@@ -11,11 +12,12 @@ class Creature:
         location: Tuple[int, int],
         type: str,
         genome: Optional[Genome] = None,
+        rng: Optional[np.random.Generator] = None,
     ):
         self.id = id
         self.location = location
 
-        stats = CreatureStat(genome)
+        stats = CreatureStat(genome, rng=rng)
         self.genome: Genome = stats.get_genome()
         self.stats: Stats = stats.get_stats()
         self.status: Status = stats.get_status()
@@ -1,5 +1,5 @@
-import random
 from dataclasses import dataclass
+import numpy as np
 from typing import TYPE_CHECKING, Tuple, List, Dict, Union, Optional, TypeAlias
 
 Genome: TypeAlias = Dict[str, List[int]]
@@ -71,7 +71,12 @@ GENOME_KEYS = [
 
 
 class CreatureStat:
-    def __init__(self, genome: Optional[Genome] = None):
+    def __init__(
+        self,
+        genome: Optional[Genome] = None,
+        rng: Optional[np.random.Generator] = None,
+    ):
+        self.rng = rng if rng is not None else np.random.default_rng()
         self.genome = genome if genome else self._initialize_genome(GENOME_BITS)
         self.stats = self._calculate_stats(self.genome)
         self.status = Status()
@@ -108,7 +113,11 @@ class CreatureStat:
                 (key, i) for key in GENOME_KEYS for i in range(n_bits)
             ]
 
-            for key, idx in random.sample(available_positions, remaining_points):
+            picks = self.rng.choice(
+                len(available_positions), size=remaining_points, replace=False
+            )
+            for pick in picks:
+                key, idx = available_positions[pick]
                 new_genome[key][idx] = 1
 
         return new_genome
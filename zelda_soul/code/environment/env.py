@@ -3,20 +3,27 @@ import gymnasium as gym
 from gymnasium import spaces
 import numpy as np
 from dataclasses import asdict, dataclass
-import random
-import copy
 from typing import Dict, List, Tuple, Optional, Union, TypeAlias, Any
 
 
 from entities.creature import Creature
 from entities.resource import Resource
 from environment.pathfinder import Pathfinder
+from environment.snapshot import snapshot_environment, restore_environment
+from ai.batch_ai import BatchAI
 from ai.simple_ai import SimpleAI
 from entities.actions import Action
 from settings import MAX_STEP_COUNT
+from utils.metrics import Metrics, NULL_METRICS
 
 GridType: TypeAlias = List[List[str]]
 Location: TypeAlias = Tuple[int, int]
+CellDelta: TypeAlias = Tuple[int, int, int, int]  # x, y, old type, new type
+Seed: TypeAlias = Union[int, np.random.SeedSequence, None]
+
+# child streams spawned from the environment seed, in spawn order.
+# append new streams at the end so existing ones keep their values.
+RNG_STREAMS = ("spawn", "genome", "crossover", "ai")
 
 
 @dataclass
@@ -25,6 +32,9 @@ class EnvironmentConfig:
     n_creature: int = 4
     n_resource: int = 8
     resource_hp: int = 20
+    seed: Seed = None
+    observation_delta: bool = False  # add changed cells to step info
+    observation_window: Optional[int] = None  # odd k, k x k view around the player
 
 
 class Environment(gym.Env):
@@ -32,10 +42,12 @@ class Environment(gym.Env):
 
     def __init__(
         self,
+        config: Optional[EnvironmentConfig] = None,
         render_mode: str = "console",
+        ai=None,
     ) -> None:
         super(Environment, self).__init__()
-        self.config = EnvironmentConfig()
+        self.config = config if config else EnvironmentConfig()
         self.n_types = 4  # 0 for empty, 1 for player, 2 for creature, 3 for resource
 
         self.render_mode = render_mode
@@ -65,16 +77,47 @@ class Environment(gym.Env):
         self.grid: GridType = [
             ["-1"] * self.config.size for _ in range(self.config.size)
         ]
+
+        # cached observation, patched from the cells touched since last encode.
+        # grid_onehot is the interior of a zero padded buffer so egocentric
+        # windows are plain slices; padding cells encode as all zeros.
+        window = self.config.observation_window
+        if window is not None and window % 2 == 0:
+            raise ValueError(f"observation_window must be odd, got {window}")
+        self.pad = window // 2 if window else 0
+        self.type_grid = np.zeros((self.config.size, self.config.size), dtype=np.int8)
+        self.padded_onehot = np.zeros(
+            (
+                self.config.size + 2 * self.pad,
+                self.config.size + 2 * self.pad,
+                self.n_types,
+            ),
+            dtype=np.int8,
+        )
+        self.grid_onehot = self.padded_onehot[
+            self.pad : self.pad + self.config.size,
+            self.pad : self.pad + self.config.size,
+        ]
+        self.changed_cells: set[Location] = set()
+        self.rebuild_observation = True
+        self.last_delta: List[CellDelta] = []
+        # type each cell had at the last step(); only step() clears it, so
+        # encodes in between (batched AI, render) cannot drop changes
+        self.step_changes: Dict[Location, int] = {}
         self.pathfinder = Pathfinder()
-        self.ai = SimpleAI()
+        # per-creature SimpleAI unless a controller such as RuleBasedAI is given
+        self.ai = ai if ai is not None else SimpleAI()
 
         self.entities: Dict[str, Union[Creature, Resource]] = {}
         self.action_history = []
         self.actions = Action()
+        self.seed_rngs(self.config.seed)
 
         self.resource_counter = 0
         self.creature_counter = 0
 
+        self.metrics: Metrics = NULL_METRICS
+
         self.state = None
         self.reward = None
         self.terminated = None
@@ -83,9 +126,8 @@ class Environment(gym.Env):
 
         self.populate()
 
-        onehot = spaces.MultiBinary(
-            self.config.size * self.config.size * self.n_types + len(self.int_to_action)
-        )
+        side = window if window else self.config.size
+        onehot = spaces.MultiBinary(side * side * self.n_types + len(self.int_to_action))
 
         continuous = spaces.Box(
             low=0,
@@ -101,33 +143,98 @@ class Environment(gym.Env):
             }
         )
 
-    def observation(self, action_int=0):
-        def convert_string(s):
-            if s.startswith("c"):
-                return 2
-            elif s.startswith("r"):
-                return 3
-            else:
-                return 0
+    def seed_rngs(self, seed: Seed = None) -> None:
+        """Create the environment generator and one child stream per subsystem."""
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed_sequence = seed
+        self.rng = np.random.default_rng(seed)
+        # children built by hand: spawn() would advance the caller's
+        # sequence, so reusing it would give a different world
+        self.rngs: Dict[str, np.random.Generator] = {
+            name: np.random.default_rng(
+                np.random.SeedSequence(
+                    seed.entropy,
+                    spawn_key=seed.spawn_key + (i,),
+                    pool_size=seed.pool_size,
+                )
+            )
+            for i, name in enumerate(RNG_STREAMS)
+        }
 
-        contiuous_list = []
-        one_hot_list = []
-        self.output_grid = copy.deepcopy(self.grid)
-        for y, row in enumerate(self.grid):
-            for x, s in enumerate(row):
-                if s == self.player.id:
-                    self.output_grid[y][x] = 1
-                else:
-                    self.output_grid[y][x] = convert_string(s)
-                onehot = [0, 0, 0, 0]
-                onehot[int(self.output_grid[y][x])] = 1
-                one_hot_list.extend(onehot)
+        self.pathfinder.rng = self.rngs["spawn"]
+        self.actions.rng = self.rngs["crossover"]
+
+    def cell_type(self, s: str) -> int:
+        if s == self.player.id:
+            return 1
+        elif s.startswith("c"):
+            return 2
+        elif s.startswith("r"):
+            return 3
+        else:
+            return 0
 
-        one_hot_action = [0] * len(self.int_to_action)
+    def set_cell(self, location: Location, value: str) -> None:
+        x, y = location
+        self.grid[y][x] = value
+        self.changed_cells.add(location)
+
+    def update_observation(self) -> List[CellDelta]:
+        """Bring the cached one-hot grid up to date, return the changed cells."""
+        delta = []
+        if self.rebuild_observation:
+            codes = np.array(
+                [[self.cell_type(s) for s in row] for row in self.grid], dtype=np.int8
+            )
+            for y, x in zip(*np.nonzero(codes != self.type_grid)):
+                delta.append((int(x), int(y), int(self.type_grid[y, x]), int(codes[y, x])))
+            self.type_grid[...] = codes
+            self.grid_onehot[...] = np.eye(self.n_types, dtype=np.int8)[codes]
+            self.rebuild_observation = False
+        else:
+            for x, y in self.changed_cells:
+                old = int(self.type_grid[y, x])
+                new = self.cell_type(self.grid[y][x])
+                if old != new:
+                    self.type_grid[y, x] = new
+                    self.grid_onehot[y, x, old] = 0
+                    self.grid_onehot[y, x, new] = 1
+                    delta.append((x, y, old, new))
+        self.changed_cells.clear()
+        self.last_delta = delta
+        for x, y, old, _ in delta:
+            self.step_changes.setdefault((x, y), old)
+        return delta
+
+    def take_step_delta(self) -> List[CellDelta]:
+        """Cells whose type differs from the last call, then start over."""
+        delta = [
+            (x, y, old, int(self.type_grid[y, x]))
+            for (x, y), old in self.step_changes.items()
+            if old != self.type_grid[y, x]
+        ]
+        self.step_changes.clear()
+        return delta
+
+    def local_onehot(self, location: Location) -> np.ndarray:
+        """k x k x n_types view of the cached one-hot grid centred on location."""
+        k = self.config.observation_window
+        x, y = location
+        return self.padded_onehot[y : y + k, x : x + k]
+
+    def observation(self, action_int=0):
+        self.update_observation()
+        if self.config.observation_window:
+            grid_onehot = self.local_onehot(self.player.location)
+        else:
+            grid_onehot = self.grid_onehot
+
+        one_hot_action = np.zeros(len(self.int_to_action), dtype=np.int8)
         one_hot_action[action_int] = 1
-        one_hot_list.extend(one_hot_action)
-        # add stats
 
+        # add stats
+        contiuous_list = []
         for key, value in asdict(self.player.status).items():
             contiuous_list.append(value)
 
@@ -135,10 +242,58 @@ class Environment(gym.Env):
         contiuous_list.append(self.player.stats.energy)
 
         return {
-            "onehot": np.array(one_hot_list, dtype=np.int8),
+            "onehot": np.concatenate((grid_onehot.reshape(-1), one_hot_action)),
             "continuous": np.array(contiuous_list, dtype=np.int32),
         }
 
+    def observations(self, creatures: List[Creature]) -> Dict[str, np.ndarray]:
+        """Batched observations, each row seen from one creature as the player."""
+        self.update_observation()
+        n = len(creatures)
+        locations = np.array([c.location for c in creatures], dtype=np.int64).reshape(
+            n, 2
+        )
+        rows = np.arange(n)
+
+        k = self.config.observation_window
+        if k:
+            grids = np.stack([self.local_onehot(c.location) for c in creatures])
+            cx = cy = np.full(n, self.pad)
+            side = k
+        else:
+            grids = np.repeat(self.grid_onehot[np.newaxis], n, axis=0)
+            cx, cy = locations[:, 0], locations[:, 1]
+            side = self.config.size
+
+        # the real player shows up as an ordinary creature to everyone else
+        px, py = self.player.location
+        px = px - locations[:, 0] + cx
+        py = py - locations[:, 1] + cy
+        others = np.array([c is not self.player for c in creatures], dtype=bool)
+        visible = others & (0 <= px) & (px < side) & (0 <= py) & (py < side)
+        if self.player.id in self.entities and visible.any():
+            grids[rows[visible], py[visible], px[visible]] = 0
+            grids[rows[visible], py[visible], px[visible], 2] = 1
+
+        grids[rows, cy, cx] = 0
+        grids[rows, cy, cx, 1] = 1
+
+        one_hot_action = np.zeros((n, len(self.int_to_action)), dtype=np.int8)
+        one_hot_action[:, 0] = 1
+
+        continuous = np.array(
+            [
+                [*asdict(c.status).values(), c.stats.hp, c.stats.energy]
+                for c in creatures
+            ],
+            dtype=np.int32,
+        ).reshape(n, -1)
+
+        return {
+            "onehot": np.concatenate((grids.reshape(n, -1), one_hot_action), axis=1),
+            "continuous": continuous,
+        }
+
     def add_creatures(self, creatures: List[Creature]) -> bool:
         for creature in creatures:
             creature = self._create_creature(creature=creature)
@@ -188,11 +343,11 @@ class Environment(gym.Env):
                 location=location,
                 type="creature",
                 genome=genome,
+                rng=self.rngs["genome"],
             )
 
         self.entities[id] = creature
-        x, y = creature.location
-        self.grid[y][x] = id
+        self.set_cell(creature.location, id)
         return creature
 
     def _create_resource(
@@ -212,12 +367,11 @@ class Environment(gym.Env):
                 id=id,
                 location=location,
                 type="edible",
-                hp=hp if hp else random.randint(50, 150),
+                hp=hp if hp else int(self.rngs["spawn"].integers(50, 151)),
             )
 
         self.entities[id] = resource
-        x, y = location
-        self.grid[y][x] = id
+        self.set_cell(location, id)
         return resource
 
     def get_entity(self, entity_id: str) -> Optional[Union[Creature, Resource]]:
@@ -228,7 +382,7 @@ class Environment(gym.Env):
         self.observation()
         if self.render_mode == "console":
             # print("" + " ".join([f"{i:2}" for i in range(self.config.size)]))
-            for idx, row in enumerate(self.output_grid):
+            for idx, row in enumerate(self.type_grid.tolist()):
                 # Print row number and row content
                 print(" ".join([str(cell) for cell in row]))
                 # print(f"{idx:2} " + " ".join([str(cell) for cell in row]))
@@ -239,12 +393,12 @@ class Environment(gym.Env):
 
     def remove_deleted(self, deleted_ids) -> bool:
         for id in deleted_ids:
-            x, y = self.entities[id].location
-            self.grid[y][x] = "-1"
+            self.set_cell(self.entities[id].location, "-1")
             del self.entities[id]
         return True
 
     def env_step(self) -> None:
+        creatures = []
         # Process all entities
         for entity_id, entity in list(self.entities.items()):
             # Apply decay
@@ -258,14 +412,62 @@ class Environment(gym.Env):
 
             # Run AI
             if isinstance(entity, Creature):
-                action, target_id, success = self.ai.step(entity, self)
-                self.action_history.append((entity_id, action, target_id, success))
+                if isinstance(self.ai, BatchAI):
+                    creatures.append(entity)
+                else:
+                    action, target_id, success = self.ai.step(entity, self)
+                    self.action_history.append((entity_id, action, target_id, success))
+
+        # one controller call for the whole population
+        if creatures:
+            self.action_history.extend(self.ai.step(creatures, self))
+
+    def select_target(
+        self, c: Creature, action: str
+    ) -> Optional[Union[Creature, Resource]]:
+        """First adjacent entity an action can be applied to."""
+        target_ids = self.pathfinder.get_adjacent_entities(c.location, self)
+
+        entities = [self.get_entity(id) for id in target_ids]
+        creatures = [entity for entity in entities if isinstance(entity, Creature)]
+        resources = [entity for entity in entities if isinstance(entity, Resource)]
+
+        if action == "attack" or action == "heal_other" or action == "reproduce":
+            # find target creature
+            if creatures:
+                return creatures[0]
+
+        elif action == "harvest":
+            # find target resource
+            if resources:
+                return resources[0]
+
+        return None
 
     def set_current_player(self, id):
+        self.changed_cells.add(self.player.location)
         self.player = self.entities[id]
+        self.changed_cells.add(self.player.location)
+
+    def snapshot(self) -> bytes:
+        """Full world state (grid, entities, counters, RNG) as a fixed-layout buffer."""
+        return snapshot_environment(self)
+
+    def restore(self, buffer: bytes) -> None:
+        restore_environment(self, buffer)
+        self.rebuild_observation = True
 
     def reset(self, seed=None, options=None):
+        if seed is not None:
+            self.seed_rngs(seed)
+        if options and options.get("snapshot"):
+            # reset to a fixed start state instead of re-populating
+            self.restore(options["snapshot"])
+            observation = self.observation()
+            self.step_changes.clear()
+            return observation, {"info": "Environement restored"}
         self.grid = [["-1"] * self.config.size for _ in range(self.config.size)]
+        self.rebuild_observation = True
         self.entities = {}
         self.creature_counter = 0
         self.resource_counter = 0
@@ -275,7 +477,9 @@ class Environment(gym.Env):
         self.populate()
 
         # [ value for all location]
-        return self.observation(), {"info": "Environement reset"}
+        observation = self.observation()
+        self.step_changes.clear()
+        return observation, {"info": "Environement reset"}
 
     def step(self, action) -> (Any, Any, Any, Any, Any):
 
@@ -293,27 +497,7 @@ class Environment(gym.Env):
             reward = -200
         else:
             action = self.int_to_action[int(action)]
-            target_ids = self.pathfinder.get_adjacent_entities(
-                self.player.location, self
-            )
-
-            entities = [self.get_entity(id) for id in target_ids]
-            creatures = [entity for entity in entities if isinstance(entity, Creature)]
-            resources = [entity for entity in entities if isinstance(entity, Resource)]
-
-            if action == "attack" or action == "heal" or action == "reproduce":
-                # find target creature
-                if creatures:
-                    target = creatures[0]
-                else:
-                    target = None
-
-            elif action == "harvest":
-                # find target resource
-                if resources:
-                    target = resources[0]
-                else:
-                    target = None
+            target = self.select_target(self.player, action)
 
             info, reward = self.actions.set_action(
                 action, c=self.player, target=target, env=self
@@ -328,12 +512,18 @@ class Environment(gym.Env):
 
         # decay
         self.player.stats.hp -= 1
-        next_state = self.observation(action_int)
+        with self.metrics.timer("observation_encode"):
+            next_state = self.observation(action_int)
+        self.metrics.count("env_steps")
         self.step_count += 1
         if self.step_count >= MAX_STEP_COUNT:
             truncated = True
 
-        return next_state, reward, terminated, truncated, {}
+        info = {}
+        if self.config.observation_delta:
+            info["delta"] = self.take_step_delta()
+
+        return next_state, reward, terminated, truncated, info
 
     def close(self):
         pass
@@ -1,6 +1,6 @@
 import pygame
 from queue import PriorityQueue
-import random
+import numpy as np
 from typing import TYPE_CHECKING, List, Optional, TypeAlias, Tuple, Union
 
 if TYPE_CHECKING:
@@ -12,8 +12,8 @@ Location: TypeAlias = Tuple[int, int]
 
 
 class Pathfinder:
-    def __init__(self):
-        pass
+    def __init__(self, rng: Optional[np.random.Generator] = None):
+        self.rng = rng if rng is not None else np.random.default_rng()
 
     def get_all_movable_cells(
         self, creature: "Creature", env: "Environment"
@@ -144,7 +144,7 @@ class Pathfinder:
                     empty_cells.append((x, y))
 
         if empty_cells:
-            location = random.choice(empty_cells)
+            location = empty_cells[self.rng.integers(len(empty_cells))]
             return location
         return None
 
@@ -211,8 +211,8 @@ class Pathfinder:
         ):
 
             # Update grid
-            env.grid[old_y][old_x] = "-1"
-            env.grid[new_y][new_x] = c.id
+            env.set_cell((old_x, old_y), "-1")
+            env.set_cell((new_x, new_y), c.id)
 
             # Update entity location
             c.location = new_location
@@ -0,0 +1,229 @@
+from dataclasses import fields
+from typing import TYPE_CHECKING, Dict, List, Union
+
+import numpy as np
+
+from entities.creature import Creature
+from entities.resource import Resource
+from entities.stats import GENOME_BITS, GENOME_KEYS, Stats, Status
+
+if TYPE_CHECKING:
+    from environment.env import Environment
+
+SNAPSHOT_VERSION = 2  # 2: "ai" RNG stream
+
+EMPTY = 0
+CREATURE = 1
+RESOURCE = 2
+
+STATS_FIELDS = [f.name for f in fields(Stats)]
+STATUS_FIELDS = [f.name for f in fields(Status)]
+STATUS_TYPES = {f.name: f.type for f in fields(Status)}
+HP_INDEX = STATS_FIELDS.index("hp")
+
+MASK_64 = (1 << 64) - 1
+
+HEADER_DTYPE = np.dtype(
+    [
+        ("version", np.int32),
+        ("size", np.int32),
+        ("n_entities", np.int32),
+        ("player_index", np.int32),
+        ("creature_counter", np.int64),
+        ("resource_counter", np.int64),
+        ("step_count", np.int64),
+    ]
+)
+
+# PCG64 state, 128-bit words split into (high, low) halves
+RNG_DTYPE = np.dtype(
+    [
+        ("state", np.uint64, (2,)),
+        ("inc", np.uint64, (2,)),
+        ("has_uint32", np.int32),
+        ("uinteger", np.uint32),
+    ]
+)
+
+ENTITY_DTYPE = np.dtype(
+    [
+        ("kind", np.int8),
+        ("in_world", np.int8),
+        ("number", np.int64),
+        ("location", np.int32, (2,)),
+        ("stats", np.float64, (len(STATS_FIELDS),)),
+        ("status", np.int64, (len(STATUS_FIELDS),)),
+        ("genome", np.uint8, (len(GENOME_KEYS) * GENOME_BITS,)),
+    ]
+)
+
+
+def snapshot_dtype(size: int, n_rngs: int) -> np.dtype:
+    """Fixed layout for one world of the given size.
+
+    Every entity holds one cell, so size * size records always suffice; the
+    extra record keeps a player that has already been removed from the grid.
+    """
+    return np.dtype(
+        [
+            ("header", HEADER_DTYPE),
+            ("rngs", RNG_DTYPE, (n_rngs,)),
+            ("grid", np.int32, (size, size)),
+            ("entities", ENTITY_DTYPE, (size * size + 1,)),
+        ]
+    )
+
+
+def _generators(env: "Environment") -> List[np.random.Generator]:
+    return [env.rng, *env.rngs.values()]
+
+
+def _pack_rng(record: np.void, generator: np.random.Generator) -> None:
+    state = generator.bit_generator.state
+    if state["bit_generator"] != "PCG64":
+        raise ValueError(f"Cannot snapshot {state['bit_generator']} generators")
+    words = state["state"]
+    record["state"] = (words["state"] >> 64, words["state"] & MASK_64)
+    record["inc"] = (words["inc"] >> 64, words["inc"] & MASK_64)
+    record["has_uint32"] = state["has_uint32"]
+    record["uinteger"] = state["uinteger"]
+
+
+def _unpack_rng(record: np.void, generator: np.random.Generator) -> None:
+    state_hi, state_lo = (int(word) for word in record["state"])
+    inc_hi, inc_lo = (int(word) for word in record["inc"])
+    generator.bit_generator.state = {
+        "bit_generator": "PCG64",
+        "state": {
+            "state": (state_hi << 64) | state_lo,
+            "inc": (inc_hi << 64) | inc_lo,
+        },
+        "has_uint32": int(record["has_uint32"]),
+        "uinteger": int(record["uinteger"]),
+    }
+
+
+def _to_python(value: np.floating) -> Union[int, float]:
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def snapshot_environment(env: "Environment") -> bytes:
+    """Serialise the full world into a single fixed-layout byte buffer."""
+    generators = _generators(env)
+    size = env.config.size
+    snapshot = np.zeros((), dtype=snapshot_dtype(size, len(generators)))
+
+    table = list(env.entities.values())
+    if env.player not in table:
+        table.append(env.player)
+
+    index: Dict[str, int] = {}
+    records = snapshot["entities"]
+    for i, entity in enumerate(table):
+        record = records[i]
+        index[entity.id] = i
+        record["number"] = int(entity.id[1:])
+        record["location"] = entity.location
+        record["in_world"] = entity.id in env.entities
+        if isinstance(entity, Creature):
+            record["kind"] = CREATURE
+            record["stats"] = [getattr(entity.stats, f) for f in STATS_FIELDS]
+            record["status"] = [getattr(entity.status, f) for f in STATUS_FIELDS]
+            record["genome"] = [bit for key in GENOME_KEYS for bit in entity.genome[key]]
+        else:
+            record["kind"] = RESOURCE
+            record["stats"][HP_INDEX] = entity.stats.hp
+            record["status"][STATUS_FIELDS.index("deleted")] = entity.status.deleted
+
+    grid = snapshot["grid"]
+    grid[...] = -1
+    for y, row in enumerate(env.grid):
+        for x, cell in enumerate(row):
+            if cell != "-1":
+                grid[y, x] = index[cell]
+
+    header = snapshot["header"]
+    header["version"] = SNAPSHOT_VERSION
+    header["size"] = size
+    header["n_entities"] = len(table)
+    header["player_index"] = index[env.player.id]
+    header["creature_counter"] = env.creature_counter
+    header["resource_counter"] = env.resource_counter
+    header["step_count"] = env.step_count
+
+    for record, generator in zip(snapshot["rngs"], generators):
+        _pack_rng(record, generator)
+
+    return snapshot.tobytes()
+
+
+def restore_environment(env: "Environment", buffer: bytes) -> None:
+    """Load a buffer produced by snapshot_environment back into env in place."""
+    generators = _generators(env)
+    size = env.config.size
+    dtype = snapshot_dtype(size, len(generators))
+    if len(buffer) != dtype.itemsize:
+        raise ValueError(
+            f"Snapshot is {len(buffer)} bytes, expected {dtype.itemsize} "
+            f"for size {size}"
+        )
+    # zero-copy view over the buffer
+    snapshot = np.frombuffer(buffer, dtype=dtype)[0]
+    header = snapshot["header"]
+    if header["version"] != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {header['version']}")
+
+    entities: Dict[str, Union[Creature, Resource]] = {}
+    table: List[Union[Creature, Resource]] = []
+    for record in snapshot["entities"][: header["n_entities"]]:
+        location = (int(record["location"][0]), int(record["location"][1]))
+        stats = record["stats"]
+        status = record["status"]
+        if record["kind"] == CREATURE:
+            genome = {
+                key: bits.tolist()
+                for key, bits in zip(
+                    GENOME_KEYS, record["genome"].reshape(len(GENOME_KEYS), -1)
+                )
+            }
+            entity = Creature(
+                id=f"c{record['number']}",
+                location=location,
+                type="creature",
+                genome=genome,
+                rng=env.rngs["genome"],
+            )
+            entity.stats = Stats(
+                **{f: _to_python(v) for f, v in zip(STATS_FIELDS, stats)}
+            )
+            entity.status = Status(
+                **{f: STATUS_TYPES[f](v) for f, v in zip(STATUS_FIELDS, status)}
+            )
+        else:
+            entity = Resource(
+                id=f"r{record['number']}",
+                location=location,
+                type="edible",
+                hp=_to_python(stats[HP_INDEX]),
+            )
+            entity.status.deleted = bool(status[STATUS_FIELDS.index("deleted")])
+
+        table.append(entity)
+        if record["in_world"]:
+            entities[entity.id] = entity
+
+    ids = [entity.id for entity in table]
+    env.grid = [
+        [ids[cell] if cell >= 0 else "-1" for cell in row]
+        for row in snapshot["grid"].tolist()
+    ]
+    env.entities = entities
+    env.player = table[header["player_index"]]
+    env.creature_counter = int(header["creature_counter"])
+    env.resource_counter = int(header["resource_counter"])
+    env.step_count = int(header["step_count"])
+    env.action_history = []
+
+    for record, generator in zip(snapshot["rngs"], generators):
+        _unpack_rng(record, generator)
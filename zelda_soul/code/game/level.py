@@ -101,7 +101,10 @@ class Level:
         ]
         if deleted:
             for id in deleted:
-                self.sprites[id].kill()
+                # entities spawned by the env may not have a sprite yet
+                sprite = self.sprites.pop(id, None)
+                if sprite is not None:
+                    sprite.kill()
                 # remove entity from environement
             self.env.remove_deleted(deleted)
 
@@ -0,0 +1,115 @@
+from typing import Any, Dict, Optional, Tuple
+
+from settings import OBSERVATION_SIGNIFICANCE
+
+# hp fractions whose crossing is worth a new decision
+HP_BANDS = (0.25, 0.5, 0.75)
+
+# significance of each kind of change; a decision needs OBSERVATION_SIGNIFICANCE
+WEIGHTS = {
+    "event": 1.0,  # something happened to us (attacked, healed, killed...)
+    "hp_band": 0.8,  # own hp crossed a band
+    "targeted": 0.7,  # someone started targeting us
+    "entered": 0.6,
+    "observed": 0.5,  # saw something happen to a nearby entity
+    "left": 0.3,
+    "other_hp_band": 0.3,
+    "other_action": 0.2,
+    "objects": 0.1,
+}
+
+
+def _fraction(value: str) -> float:
+    current, _, maximum = str(value).partition("/")
+    try:
+        return float(current) / float(maximum)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def _band(observation: Dict[str, Any]) -> int:
+    hp = _fraction(observation["stats"]["health"])
+    return sum(hp >= edge for edge in HP_BANDS)
+
+
+class ObservationDiffer:
+    """Compares an enemy's observation with the last one it kept.
+
+    diff() returns a compact change record (entities that entered or left,
+    hp bands crossed, new events and targets) and a significance score.
+    The baseline only moves on keep(), so small changes accumulate until
+    together they are worth a decision.
+    """
+
+    def __init__(self, threshold: float = OBSERVATION_SIGNIFICANCE):
+        self.threshold = threshold
+        self.previous: Optional[Dict[str, Any]] = None
+
+    def diff(self, entry: Dict[str, Any]) -> Tuple[Dict[str, Any], float]:
+        if self.previous is None:
+            return {"first": True}, float("inf")
+
+        changes: Dict[str, Any] = {}
+        score = 0.0
+
+        def note(kind, value, weight=None):
+            nonlocal score
+            changes[kind] = value
+            score += WEIGHTS[kind] if weight is None else weight
+
+        own, old_own = entry["self"], self.previous["self"]
+        name = own["entity_name"]
+        events, old_events = own["observations"], old_own["observations"]
+        if events["event"] != old_events["event"] and events["event"]:
+            note("event", events["event"])
+        if _band(own) != _band(old_own):
+            note("hp_band", own["stats"]["health"])
+
+        now = {e["entity_name"]: e for e in entry["nearby_entities"]}
+        observed = events["observed"]
+        # observed events are broadcast as "<source> <event>"; ones whose
+        # source is out of notice radius say nothing about our surroundings
+        if (
+            observed
+            and observed != old_events["observed"]
+            and any(observed.startswith(f"{other} ") for other in now)
+        ):
+            note("observed", observed)
+        before = {e["entity_name"]: e for e in self.previous["nearby_entities"]}
+        entered = [n for n in now if n not in before]
+        left = [n for n in before if n not in now]
+        if entered:
+            note("entered", entered)
+        if left:
+            note("left", left)
+
+        targeting, acting, hp_crossed = [], {}, []
+        for other_name, other in now.items():
+            old = before.get(other_name)
+            if old is None:
+                continue
+            if other["target_name"] == name and old["target_name"] != name:
+                targeting.append(other_name)
+            if other["action"] != old["action"]:
+                acting[other_name] = other["action"]
+            if _band(other) != _band(old):
+                hp_crossed.append(other_name)
+        if targeting:
+            note("targeted", targeting)
+        if acting:
+            note("other_action", acting)
+        if hp_crossed:
+            note("other_hp_band", hp_crossed)
+
+        objects = [o["object_name"] for o in entry["nearby_objects"]]
+        if objects != [o["object_name"] for o in self.previous["nearby_objects"]]:
+            note("objects", objects)
+
+        return changes, score
+
+    def significant(self, score: float) -> bool:
+        return score >= self.threshold
+
+    def keep(self, entry: Dict[str, Any]) -> None:
+        """Make entry the baseline for the next diff."""
+        self.previous = entry
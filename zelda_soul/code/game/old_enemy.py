@@ -13,6 +13,7 @@ from settings import (
     SUMMARY_INTERVAL,
     OBSERVATION_TO_SUMMARY,
     MEMORY_SIZE,
+    LLM_SUMMARY_DEADLINE,
 )
 from debug import debug
 import time
@@ -20,10 +21,12 @@ from tooltips import TextBubble, StatusBars
 import json
 import asyncio
 from persona import Persona
-from memstream import MemoryStream
+from memstream import get_memory_stream
+from observation import ObservationDiffer
+from fallback import get_fallback_policy
 from support import get_distance_direction, wave_value
 import random
-from priorityqueue import PriorityQueueWithUpdate
+from scheduler import LLMScheduler
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
@@ -46,15 +49,18 @@ class Enemy(Entity):
         obstacle_sprites,
         visible_sprite,
         # api,
-        global_queue: PriorityQueueWithUpdate,
+        global_queue: LLMScheduler,
     ):
 
         # general setup
         super().__init__(groups)
         self.sprite_type = "enemy"
         self.groups = groups
-        self.memory = MemoryStream()
-        self.persona = Persona()
+        self.memory = get_memory_stream()
+        self.persona = Persona(memory=self.memory)
+        self.observation_differ = ObservationDiffer()
+        self.fallback = get_fallback_policy()
+        self.llm_decisions = 0
         self.global_queue = global_queue
 
         # graphic setup
@@ -195,15 +201,13 @@ class Enemy(Entity):
 
             target.get_heal(healer=self)
 
-    def save_observation(
+    def build_observation(
         self,
         player: "Player",
         entities: list["Enemy"],
         objects: list["Tile"],
     ):
-        # self.can_save_observation = False
-        self.observation_count += 1
-        """Logs the enemy's memory including nearby entities and objects within notice radius."""
+        """The enemy's view of itself and nearby entities and objects within notice radius."""
         timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
 
         memory_entry = {
@@ -241,8 +245,18 @@ class Enemy(Entity):
                 }
             )
 
+        return memory_entry
+
+    def save_observation(self, memory_entry, changes=None):
+        """Logs the observation and makes it the baseline for the next diff."""
+        self.observation_count += 1
+        if changes:
+            memory_entry["changes"] = changes
+        self.observation_differ.keep(memory_entry)
+
         filename = f"stream_{self.full_name}.json"
         self.memory.write_memory(memory_entry, filename, threshold=MEMORY_SIZE)
+        self.persona.remember(memory_entry)
 
     def observation_template(self, entity: "Entity"):
         if entity.sprite_type == "player":
@@ -326,10 +340,11 @@ class Enemy(Entity):
 
     def set_decision(self, decision):
         if decision:
+            # a streamed decision arrives before vigilant and reason
             self.target_name = decision["target_name"]
-            self.vigilant = int(decision["vigilant"])
+            self.vigilant = int(decision.get("vigilant", self.vigilant))
             self.action = decision["action"]
-            self.reason = decision["reason"]
+            self.reason = decision.get("reason", self.reason)
 
             if decision["target_name"] == "None":
                 self.target_name = None
@@ -338,13 +353,23 @@ class Enemy(Entity):
             # self.target_name = "player"
             # self.action = "runaway"
 
+    def fallback_decision(self, memory_entry):
+        """Act on a heuristic decision until the persona's arrives."""
+        self.set_decision(self.fallback.decide(memory_entry, self.characteristic))
+        self.fallback.record_fallback()
+
     def interaction(
         self, player: "Player", entities: list["Entity"], objects: list["Tile"]
     ):
 
-        if self.persona.decision != self.current_decision:
+        # identity, not equality: a fallback decision may have replaced an
+        # LLM one equal to the next
+        if self.persona.decision is not self.current_decision:
             self.set_decision(self.persona.decision)
             self.current_decision = self.persona.decision
+        if self.persona.decisions != self.llm_decisions:
+            self.llm_decisions = self.persona.decisions
+            self.fallback.record_llm()
 
         if not self.target_name:
             current_time = pygame.time.get_ticks()
@@ -480,15 +505,15 @@ class Enemy(Entity):
     def summary(self, distance):
         if not self.task_summary:
             self.task_summary = self.persona.summary_context(self)
-            self.global_queue.put(distance, self.task_summary)
+            self.global_queue.put(distance, self.task_summary, LLM_SUMMARY_DEADLINE)
         # if current_time - self.last_summary_time >= self.summary_interval or not self.task_summary:
         elif not self.global_queue.has(self.task_summary):
             # update priority for old task
             self.task_summary = self.persona.summary_context(self)
-            self.global_queue.put(distance, self.task_summary)
+            self.global_queue.put(distance, self.task_summary, LLM_SUMMARY_DEADLINE)
         elif self.global_queue.has(self.task_summary):
             # update priority
-            self.global_queue.put(distance, self.task_summary)
+            self.global_queue.put(distance, self.task_summary, LLM_SUMMARY_DEADLINE)
 
         print("Queue size:", self.global_queue.qsize())
 
@@ -519,7 +544,9 @@ class Enemy(Entity):
         # init
 
         if not self.first_observation:
-            self.save_observation(player, entities, objects)
+            memory_entry = self.build_observation(player, entities, objects)
+            self.save_observation(memory_entry)
+            self.fallback_decision(memory_entry)
             self.first_observation = True
 
         if not self.task_decision:
@@ -541,14 +568,20 @@ class Enemy(Entity):
             self.old_observed_event = self.observed_event
             self.old_outside_event = self.outside_event
 
-            self.save_observation(player, entities, objects)
+            # only spend an LLM call when enough has changed since the
+            # last observation that was kept
+            memory_entry = self.build_observation(player, entities, objects)
+            changes, significance = self.observation_differ.diff(memory_entry)
+            if self.observation_differ.significant(significance):
+                self.save_observation(memory_entry, changes)
 
-            # set new action
-            if self.observation_count >= MEMORY_SIZE:
-                self.observation_count = 0
-                self.summary(distance_player)
+                # set new action
+                if self.observation_count >= MEMORY_SIZE:
+                    self.observation_count = 0
+                    self.summary(distance_player)
 
-            self.decide(distance_player)
+                self.fallback_decision(memory_entry)
+                self.decide(distance_player)
 
     def enemy_update(
         self, player: "Player", entities: list["Entity"], objects: list["Tile"]
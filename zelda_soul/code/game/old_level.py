@@ -19,7 +19,7 @@ from magic import MagicPlayer
 
 # from queue import PriorityQueue
 import asyncio
-from priorityqueue import PriorityQueueWithUpdate
+from scheduler import LLMScheduler
 
 
 class Level:
@@ -35,8 +35,7 @@ class Level:
         self.attackable_sprites = pygame.sprite.Group()
         self.entities = []
         self.objects = []
-        self.global_queue = PriorityQueueWithUpdate()
-        self.decision_task = None
+        self.global_queue = LLMScheduler()
 
         # user interface
         self.ui = UI()
@@ -207,16 +206,8 @@ class Level:
             self.visible_sprites.enemy_update(self.player, self.entities, self.objects)
             self.collision()
 
-            if not self.global_queue.empty():
-                if self.decision_task is None or self.decision_task.done():
-                    priority, task = self.global_queue.get()
-
-                    self.decision_task = asyncio.create_task(
-                        asyncio.wait_for(
-                            task,
-                            timeout=60.0,
-                        )
-                    )
+            # start queued LLM requests up to the in-flight limit
+            self.global_queue.pump()
 
             # Give control back to event loop to process background tasks
             await asyncio.sleep(0)
@@ -12,12 +12,40 @@ CONTEXT_LENGTH = 8192
 CHAT_INTERVAL = 24000
 SUMMARY_INTERVAL = 72000
 GPU = -1  # 0 for CPU
+LLM_MAX_IN_FLIGHT = 4  # concurrent requests
+LLM_DEADLINE = 60.0  # seconds a decision may wait and run
+LLM_SUMMARY_DEADLINE = 120.0
+LLM_BATCH_SIZE = 8  # prompts merged per batched call
+LLM_BATCH_WAIT = 0.05  # seconds to collect a batch
+DECISION_BATCH_SIZE = 1  # NPCs decided per prompt, 1 disables; at most LLM_MAX_IN_FLIGHT
+DECISION_BATCH_WAIT = 0.1  # seconds to gather NPCs for one prompt
+PROMPT_CACHE_BYTES = 512 << 20  # llama.cpp prompt state cache, 0 disables
+RESPONSE_CACHE_SIZE = 1024  # in-memory LLM responses
+RESPONSE_CACHE_PATH = None  # e.g. "../memory/responses.sqlite" to persist
+LLM_REQUEST_TIMEOUT = 30.0  # seconds per backend call
+LLM_MAX_RETRIES = 2  # retries on connection errors, 429 and 5xx
+LLM_MAX_PENDING = 32  # requests waiting for a backend slot before rejecting
+OPENAI_BASE_URL = None  # e.g. "http://localhost:8080/v1" for a compatible server
+PROMPT_TOKEN_BUDGET = 2048  # tokens a persona prompt may use
+LLM_METRICS_PATH = None  # e.g. "../logs/llm_usage.csv" for token and latency logs
+LLM_METRICS_INTERVAL = 60.0  # seconds between usage log rows
+LLM_USAGE_LOG_PATH = None  # e.g. "../logs/llm_calls.csv" for one row per LLM call
 
 # event
 OBSERVATION_COOLDOWN = 2000
 MEMORY_SIZE = 3
 SUMMARY_SIZE = 3
+MEMORY_COMPACT_FACTOR = 4  # rewrite a memory log once it holds this many times its size
+MEMORY_BACKEND = "jsonl"  # "jsonl" files per entity or one "sqlite" database
+MEMORY_DB_PATH = "../memory/memory.sqlite"
+RETRIEVAL_K = 3  # older memories recalled into each decision prompt
+RETRIEVAL_CAPACITY = 2048  # memories indexed per NPC
+RETRIEVAL_HALF_LIFE = 600.0  # seconds for recency to halve
+EMBEDDING_MODEL = None  # e.g. "all-MiniLM-L6-v2"; None uses feature hashing
+EMBEDDING_DIM = 512  # hashing embedder size
 OBSERVATION_TO_SUMMARY = 3
+OBSERVATION_SIGNIFICANCE = 0.5  # change score needed before an NPC decides again
+FALLBACK_LOW_HP = 0.3  # hp fraction below which the fallback policy flees
 # ui
 BAR_HEIGHT = 20
 HEALTH_BAR_WIDTH = 150
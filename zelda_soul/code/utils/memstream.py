@@ -1,62 +1,324 @@
-import os
-import time
+import atexit
 import json
-from typing import TYPE_CHECKING
-import pygame
-from support import get_distance_direction
-from settings import MEMORY_SIZE
-if TYPE_CHECKING:
-    from entity import Entity
-    from tile import Tile
-    from player import Player
-    from enemy import Enemy
+import os
+import sqlite3
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from settings import (
+    MEMORY_SIZE,
+    SUMMARY_SIZE,
+    MEMORY_COMPACT_FACTOR,
+    MEMORY_BACKEND,
+    MEMORY_DB_PATH,
+)
 
+MEMORY_DIR = "../memory"
 
-class MemoryStream:
 
-    def write_memory(self, memory_entry,  filename, threshold):
-        os.makedirs("../memory", exist_ok=True)
-        memories_file = f"../memory/{filename}"
-        
-        try:
-            with open(memories_file, "r") as f:
-                try:
-                    memories = json.load(f)
-                except json.JSONDecodeError:
-                    memories = []
-            
-            if len(memories) >= threshold:
-                memories = memories[-(threshold - 1):]  # Keep last 99 entries to add new one
-        except FileNotFoundError:
-            memories = []
-
-        # Append new memory
-        memories.append(memory_entry)
-        
-        # Write updated memories
-        with open(memories_file, "w") as file:
-                json.dump(memories, file, indent=2)
-                
-    
-    def read_last_n_records(self, filename,n=None ):
+def _encode(record) -> bytes:
+    return (json.dumps(record, separators=(",", ":")) + "\n").encode()
+
+
+class JsonlStore:
+    """Append-only JSON-lines log per memory file.
+
+    Each log keeps the byte offset of every line in memory, so the last n
+    records are read with one seek instead of parsing the whole file. A
+    log is rewritten down to its threshold once it holds compact_factor
+    times that many records.
+    """
+
+    def __init__(
+        self,
+        directory: str = MEMORY_DIR,
+        compact_factor: int = MEMORY_COMPACT_FACTOR,
+    ):
+        self.directory = directory
+        self.compact_factor = compact_factor
+        # start of every line, followed by the end of the file
+        self.offsets: Dict[str, List[int]] = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.directory, os.path.splitext(filename)[0] + ".jsonl")
+
+    def append(self, filename: str, records: List, threshold: int) -> None:
+        lines = [_encode(record) for record in records]
+        with self.lock:
+            offsets = self._index(filename)
+            with open(self.path(filename), "ab") as f:
+                f.writelines(lines)
+            for line in lines:
+                offsets.append(offsets[-1] + len(line))
+
+            if len(offsets) - 1 > threshold * self.compact_factor:
+                self._rewrite(filename, self._read(filename, threshold))
+
+    def commit(self) -> None:
+        """Appends go straight to the file; nothing is held back."""
+
+    def tail(self, filename: str, n: int) -> Optional[List]:
+        """Last n records, or None if the log does not exist."""
+        with self.lock:
+            self._index(filename)
+            if not os.path.exists(self.path(filename)):
+                return None
+            return self._read(filename, n)
+
+    def _index(self, filename: str) -> List[int]:
+        offsets = self.offsets.get(filename)
+        if offsets is None:
+            path = self.path(filename)
+            if not os.path.exists(path):
+                self._migrate(filename)
+            offsets = [0]
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    for line in f:
+                        offsets.append(offsets[-1] + len(line))
+            self.offsets[filename] = offsets
+        return offsets
+
+    def _read(self, filename: str, n: int) -> List:
+        offsets = self.offsets[filename]
+        start = offsets[max(len(offsets) - 1 - n, 0)]
+        if start == offsets[-1]:
+            return []
+        with open(self.path(filename), "rb") as f:
+            f.seek(start)
+            data = f.read(offsets[-1] - start)
+
+        records = []
+        for line in data.splitlines():
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # torn last line from an interrupted write
+                continue
+        return records
+
+    def _rewrite(self, filename: str, records: List) -> None:
+        path = self.path(filename)
+        lines = [_encode(record) for record in records]
+        with open(f"{path}.tmp", "wb") as f:
+            f.writelines(lines)
+        os.replace(f"{path}.tmp", path)
+
+        offsets = [0]
+        for line in lines:
+            offsets.append(offsets[-1] + len(line))
+        self.offsets[filename] = offsets
+
+    def _migrate(self, filename: str) -> None:
+        """Convert a file left by the old whole-file JSON format."""
+        legacy = os.path.join(self.directory, filename)
+        if legacy == self.path(filename) or not os.path.exists(legacy):
+            return
         try:
-            with open(f"../memory/{filename}", "r") as f:
-                try:
-                    records = json.load(f)
-                    if n:
-                        if len(records) >= n:
-                            return records[-n:]
-                except json.JSONDecodeError:
-                    records = []
-            return records
-        except FileNotFoundError:
-            return None
-
-    
-    
-    
-
-    
-    
-    
-    
\ No newline at end of file
+            with open(legacy, "r") as f:
+                records = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        if isinstance(records, list):
+            self._rewrite(filename, records)
+
+
+class SQLiteStore:
+    """All memory files as rows of one SQLite database in WAL mode.
+
+    A memory file name "<kind>_<entity>.json" maps to the (entity, kind)
+    pair, indexed together with the timestamp so last-n and latest-summary
+    reads are a single index range scan. Inserts stay in an open
+    transaction until commit(), which the writer calls once per batch.
+    """
+
+    def __init__(
+        self,
+        path: str = MEMORY_DB_PATH,
+        compact_factor: int = MEMORY_COMPACT_FACTOR,
+    ):
+        self.compact_factor = compact_factor
+        self.counts: Dict[Tuple[str, str], int] = {}
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS memories (
+                id INTEGER PRIMARY KEY,
+                entity TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                record TEXT NOT NULL
+            )"""
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS memories_entity_kind_timestamp "
+            "ON memories (entity, kind, timestamp)"
+        )
+        self.db.commit()
+
+    @staticmethod
+    def key(filename: str) -> Tuple[str, str]:
+        kind, _, entity = os.path.splitext(filename)[0].partition("_")
+        return entity, kind
+
+    def append(self, filename: str, records: List, threshold: int) -> None:
+        entity, kind = self.key(filename)
+        rows = [
+            (entity, kind, str(record.get("timestamp", "")), json.dumps(record))
+            for record in records
+        ]
+        with self.lock:
+            self.db.executemany(
+                "INSERT INTO memories (entity, kind, timestamp, record) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            count = self._count(entity, kind) + len(rows)
+            if count > threshold * self.compact_factor:
+                self.db.execute(
+                    """DELETE FROM memories WHERE entity = ? AND kind = ? AND id NOT IN (
+                        SELECT id FROM memories WHERE entity = ? AND kind = ?
+                        ORDER BY timestamp DESC, id DESC LIMIT ?
+                    )""",
+                    (entity, kind, entity, kind, threshold),
+                )
+                count = threshold
+            self.counts[(entity, kind)] = count
+
+    def commit(self) -> None:
+        with self.lock:
+            self.db.commit()
+
+    def tail(self, filename: str, n: int) -> Optional[List]:
+        """Last n records, or None if there are none."""
+        entity, kind = self.key(filename)
+        with self.lock:
+            if not self._count(entity, kind):
+                return None
+            rows = self.db.execute(
+                """SELECT record FROM memories WHERE entity = ? AND kind = ?
+                ORDER BY timestamp DESC, id DESC LIMIT ?""",
+                (entity, kind, n),
+            ).fetchall()
+        return [json.loads(row[0]) for row in reversed(rows)]
+
+    def _count(self, entity: str, kind: str) -> int:
+        count = self.counts.get((entity, kind))
+        if count is None:
+            count = self.db.execute(
+                "SELECT COUNT(*) FROM memories WHERE entity = ? AND kind = ?",
+                (entity, kind),
+            ).fetchone()[0]
+            self.counts[(entity, kind)] = count
+        return count
+
+
+class MemoryStream:
+    """Memory shared by enemies and their personas.
+
+    The last threshold records of every file live in a ring buffer, which
+    is all reads ever look at; the store is only read once per file to
+    fill it. write_memory() updates the buffer and queues the record for a
+    write-behind thread that appends queued records to the store in
+    batches and commits once per batch.
+    """
+
+    def __init__(self, store=None):
+        if store is None:
+            store = SQLiteStore() if MEMORY_BACKEND == "sqlite" else JsonlStore()
+        self.store = store
+        self.buffers: Dict[str, deque] = {}
+        self.lock = threading.Lock()
+
+        self.pending: Dict[str, List] = {}
+        self.thresholds: Dict[str, int] = {}
+        self.writing = False
+        self.condition = threading.Condition()
+        self.closed = False
+
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def capacity(filename: str) -> int:
+        return SUMMARY_SIZE if filename.startswith("summary_") else MEMORY_SIZE
+
+    def write_memory(self, memory_entry, filename, threshold):
+        with self.lock:
+            buffer = self._buffer(filename, threshold)
+            buffer.append(memory_entry)
+
+        with self.condition:
+            self.pending.setdefault(filename, []).append(memory_entry)
+            self.thresholds[filename] = threshold
+            self.condition.notify_all()
+
+    def read_last_n_records(self, filename, n=None):
+        with self.lock:
+            buffer = self._buffer(filename)
+            if not buffer:
+                return None
+            records = list(buffer)
+        return records[-n:] if n else records
+
+    def flush(self) -> None:
+        with self.condition:
+            self.condition.wait_for(lambda: not self.pending and not self.writing)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.worker.join()
+
+    def _buffer(self, filename: str, threshold: Optional[int] = None) -> deque:
+        capacity = threshold or self.capacity(filename)
+        buffer = self.buffers.get(filename)
+        if buffer is None:
+            # only touches the store the first time a file is used
+            records = self.store.tail(filename, capacity) or []
+            buffer = self.buffers[filename] = deque(records, maxlen=capacity)
+        elif buffer.maxlen < capacity:
+            buffer = self.buffers[filename] = deque(buffer, maxlen=capacity)
+        return buffer
+
+    def _run(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or self.closed)
+                if self.closed and not self.pending:
+                    return
+                batch, self.pending = self.pending, {}
+                thresholds = dict(self.thresholds)
+                self.writing = True
+
+            try:
+                for filename, records in batch.items():
+                    self.store.append(filename, records, thresholds[filename])
+                self.store.commit()
+            except Exception as e:
+                print(f"Error writing memory: {e}")
+            finally:
+                with self.condition:
+                    self.writing = False
+                    self.condition.notify_all()
+
+
+_shared_stream: Optional[MemoryStream] = None
+
+
+def get_memory_stream() -> MemoryStream:
+    """Memory shared by every entity, so personas read what enemies queued."""
+    global _shared_stream
+    if _shared_stream is None:
+        _shared_stream = MemoryStream()
+    return _shared_stream
@@ -0,0 +1,154 @@
+import csv
+import os
+import time
+from typing import Dict, Optional
+
+
+class Timer:
+    def __init__(self, metrics: "Metrics", name: str):
+        self.metrics = metrics
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class Metrics:
+    """Windowed timings, counters and scalars for training and simulation loops.
+
+    Every record is aggregated in memory (count, total, min, max) and written
+    out by log() as one row per metric, to a CSV file or TensorBoard event
+    files. A disabled instance returns before touching any state, so the
+    calls can stay in hot loops.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        path: Optional[str] = None,
+        backend: str = "csv",
+    ):
+        self.enabled = enabled
+        self.path = path
+        self.backend = backend
+        self.window: Dict[str, list] = {}
+        self.window_start = time.perf_counter()
+        self.file = None
+        self.writer = None
+
+        if enabled and path:
+            if backend == "csv":
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                new_file = not os.path.exists(path)
+                self.file = open(path, "a", newline="")
+                self.writer = csv.writer(self.file)
+                if new_file:
+                    self.writer.writerow(
+                        ["step", "time", "name", "count", "mean", "min", "max", "rate"]
+                    )
+            elif backend == "tensorboard":
+                from torch.utils.tensorboard import SummaryWriter
+
+                self.writer = SummaryWriter(log_dir=path)
+            else:
+                raise ValueError(f"Unknown metrics backend: {backend}")
+
+    def timer(self, name: str):
+        """Context manager recording the elapsed seconds under name."""
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, name)
+
+    def record(self, name: str, value: float) -> None:
+        if not self.enabled:
+            return
+        entry = self.window.get(name)
+        if entry is None:
+            self.window[name] = [1, value, value, value]
+        else:
+            entry[0] += 1
+            entry[1] += value
+            if value < entry[2]:
+                entry[2] = value
+            if value > entry[3]:
+                entry[3] = value
+
+    def count(self, name: str, n: int = 1) -> None:
+        """Count events; log() reports them as a rate per second."""
+        self.record(name, n)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        elapsed = max(time.perf_counter() - self.window_start, 1e-9)
+        return {
+            name: {
+                "count": count,
+                "mean": total / count,
+                "min": low,
+                "max": high,
+                "rate": total / elapsed,
+            }
+            for name, (count, total, low, high) in self.window.items()
+        }
+
+    def log(self, step: int, verbose: bool = False) -> Dict[str, Dict[str, float]]:
+        """Write the current window, start a new one and return its summary."""
+        if not self.enabled:
+            return {}
+        summary = self.summary()
+        now = time.time()
+        for name, values in summary.items():
+            if self.backend == "csv" and self.writer:
+                self.writer.writerow(
+                    [
+                        step,
+                        now,
+                        name,
+                        values["count"],
+                        values["mean"],
+                        values["min"],
+                        values["max"],
+                        values["rate"],
+                    ]
+                )
+            elif self.backend == "tensorboard" and self.writer:
+                self.writer.add_scalar(f"{name}/mean", values["mean"], step)
+                self.writer.add_scalar(f"{name}/rate", values["rate"], step)
+            if verbose:
+                print(
+                    f"{name}: mean {values['mean']:.6f}, "
+                    f"rate {values['rate']:.1f}/s, n {values['count']}"
+                )
+        if self.file:
+            self.file.flush()
+
+        self.window = {}
+        self.window_start = time.perf_counter()
+        return summary
+
+    def close(self) -> None:
+        if self.writer is not None and self.backend == "tensorboard":
+            self.writer.close()
+        if self.file:
+            self.file.close()
+        self.file = None
+        self.writer = None
+
+
+NULL_METRICS = Metrics(enabled=False)